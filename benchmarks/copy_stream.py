@@ -0,0 +1,113 @@
+"""
+Compares the original 1 KiB audio copy loop against Playable.write_audio_stream.
+The source stream mimics librespot's chunked input stream, a BytesIO subclass
+that only overrides read, and the progress bar is a real tqdm bar.
+
+    python benchmarks/copy_stream.py [--size-mib 10] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zotify.playable import Playable  # noqa: E402
+
+CHUNK_SIZE = 128 * 1024
+
+
+class ChunkedStream(io.BytesIO):
+    def __init__(self, data: bytes):
+        """
+        Serves reads from fixed size chunks like librespot's
+        AbsChunkedInputStream, without touching the BytesIO buffer
+        Args:
+            data: Contents of the stream
+        """
+        super().__init__()
+        self.__chunks = [
+            data[i : i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)
+        ]
+        self.__pos = 0
+        self.__size = len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self.__size - self.__pos
+        end = min(self.__pos + size, self.__size)
+        out = bytearray()
+        while self.__pos < end:
+            chunk = self.__chunks[self.__pos // CHUNK_SIZE]
+            offset = self.__pos % CHUNK_SIZE
+            part = chunk[offset : offset + end - self.__pos]
+            out += part
+            self.__pos += len(part)
+        return bytes(out)
+
+
+class Source:
+    def __init__(self, data: bytes):
+        self.size = len(data)
+        self.__stream = ChunkedStream(data)
+
+    def stream(self) -> ChunkedStream:
+        return self.__stream
+
+
+def progress(size: int) -> tqdm:
+    return tqdm(total=size, unit="B", unit_scale=True, file=open(os.devnull, "w"))
+
+
+def original(source: Source, output: Path) -> None:
+    # Copy loop as it was before reading in large chunks
+    with open(output, "wb") as f, progress(source.size) as p_bar:
+        chunk = None
+        while chunk != b"":
+            chunk = source.stream().read(1024)
+            p_bar.update(f.write(chunk))
+
+
+def current(source: Source, output: Path) -> None:
+    playable = Playable()
+    playable.input_stream = source
+    playable.duration = 0
+    playable.write_audio_stream(output, progress(source.size))
+
+
+def measure(copy: Callable[[Source, Path], None], data: bytes, repeat: int) -> float:
+    best = float("inf")
+    with TemporaryDirectory() as tmp:
+        output = Path(tmp).joinpath("track")
+        for _ in range(repeat):
+            source = Source(data)
+            start = perf_counter()
+            copy(source, output)
+            best = min(best, perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mib", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mib * 1024 * 1024)
+    old = measure(original, data, args.repeat)
+    new = measure(current, data, args.repeat)
+    print(f"original 1 KiB loop: {old * 1000:.1f} ms")
+    print(f"write_audio_stream:  {new * 1000:.1f} ms ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Compares reading track IDs with music-tag against the header-only tag probe
+on a synthetic library of Ogg, MP3 (ID3v2.3 and 2.4), FLAC and M4A files, each
+with large embedded artwork.
+
+    python benchmarks/tag_probe.py [--files 400] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import base64
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, ID3, TIT2, TSRC, TXXX
+from mutagen.ogg import OggPage
+from mutagen.oggvorbis import OggVorbis
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zotify.file import LocalFile  # noqa: E402
+from zotify.tags import probe_tags  # noqa: E402
+
+ARTWORK_SIZE = 200_000
+
+
+def write_ogg(path: Path, spotid: str, art: bytes) -> None:
+    ident = (
+        b"\x01vorbis" + struct.pack("<IBIiii", 0, 2, 44100, 0, 160000, 0) + b"\xb8\x01"
+    )
+    comment = b"\x03vorbis" + struct.pack("<I", 4) + b"test" + struct.pack("<I", 0)
+    setup = b"\x05vorbis" + b"\x00" * 100
+    pages = []
+    page = OggPage()
+    page.packets = [ident]
+    page.serial = 1
+    page.sequence = 0
+    page.position = 0
+    page.first = True
+    pages.append(page)
+    page = OggPage()
+    page.packets = [comment + b"\x01", setup]
+    page.serial = 1
+    page.sequence = 1
+    page.position = 0
+    pages.append(page)
+    for i in range(40):
+        page = OggPage()
+        page.packets = [os.urandom(4000)]
+        page.serial = 1
+        page.sequence = 2 + i
+        page.position = 44100 * (i + 1)
+        pages.append(page)
+    pages[-1].last = True
+    with open(path, "wb") as f:
+        for page in pages:
+            f.write(page.write())
+
+    tags = OggVorbis(path)
+    picture = Picture()
+    picture.data = art
+    picture.type = 3
+    picture.mime = "image/jpeg"
+    tags["title"] = "title"
+    tags["lyrics"] = "la " * 300
+    tags["metadata_block_picture"] = base64.b64encode(picture.write()).decode()
+    tags["spotid"] = spotid
+    tags["isrc"] = "US" + spotid[:10]
+    tags.save()
+
+
+def write_mp3(path: Path, spotid: str, art: bytes, version: int = 4) -> None:
+    frame = b"\xff\xfb\x90\x64" + b"\x00" * 413
+    path.write_bytes(frame * 400)
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="title"))
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=art))
+    tags.add(TXXX(encoding=1, desc="spotid", text=spotid))
+    tags.add(TSRC(encoding=0, text="US" + spotid[:10]))
+    tags.save(path, v2_version=version)
+
+
+def write_flac(path: Path, spotid: str, art: bytes) -> None:
+    stream_info = (
+        struct.pack(">HH", 4096, 4096)
+        + b"\x00\x00\x10\x00\x00\x10"
+        + bytes([0x0A, 0xC4, 0x42, 0xF0])
+        + b"\x00" * 20
+    )
+    path.write_bytes(
+        b"fLaC"
+        + bytes([0x80])
+        + len(stream_info).to_bytes(3, "big")
+        + stream_info
+        + os.urandom(300_000)
+    )
+    tags = FLAC(path)
+    picture = Picture()
+    picture.data = art
+    picture.type = 3
+    picture.mime = "image/jpeg"
+    tags.add_picture(picture)
+    tags["title"] = "title"
+    tags["spotid"] = spotid
+    tags["isrc"] = "US" + spotid[:10]
+    tags.save()
+
+
+def write_m4a(path: Path, spotid: str, art: bytes) -> None:
+    def atom(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I4s", 8 + len(body), kind) + body
+
+    def freeform(name: bytes, value: bytes) -> bytes:
+        return atom(
+            b"----",
+            atom(b"mean", b"\0" * 4 + b"com.apple.iTunes")
+            + atom(b"name", b"\0" * 4 + name)
+            + atom(b"data", struct.pack(">II", 1, 0) + value),
+        )
+
+    ilst = atom(
+        b"ilst",
+        atom(b"covr", atom(b"data", struct.pack(">II", 13, 0) + art))
+        + freeform(b"spotid", spotid.encode())
+        + freeform(b"ISRC", b"US" + spotid[:10].encode()),
+    )
+    meta = atom(b"meta", b"\0" * 4 + atom(b"hdlr", b"\0" * 25) + ilst)
+    moov = atom(b"moov", atom(b"mvhd", b"\0" * 100) + atom(b"udta", meta))
+    path.write_bytes(
+        atom(b"ftyp", b"M4A \0\0\0\0") + atom(b"mdat", os.urandom(500_000)) + moov
+    )
+
+
+def build_library(root: Path, count: int) -> list[Path]:
+    """
+    Writes a library cycling through every supported container
+    Args:
+        root: Folder to write the files in
+        count: Number of files
+    Returns:
+        Paths of the files
+    """
+    art = os.urandom(ARTWORK_SIZE)
+    writers: list[tuple[str, Callable[[Path, str, bytes], None]]] = [
+        ("ogg", write_ogg),
+        ("mp3", write_mp3),
+        ("flac", write_flac),
+        ("mp3", lambda p, s, a: write_mp3(p, s, a, 3)),
+        ("m4a", write_m4a),
+    ]
+    paths = []
+    for i in range(count):
+        ext, write = writers[i % len(writers)]
+        path = root.joinpath(f"track{i}.{ext}")
+        write(path, f"{i:022d}", art)
+        paths.append(path)
+    return paths
+
+
+def music_tag_read(path: Path) -> str | None:
+    # Upstream music-tag has no spotid key, isrc goes through the same parsing
+    try:
+        return LocalFile(path).get_metadata("isrc") or None
+    except Exception:
+        return None
+
+
+def probe_read(path: Path) -> str | None:
+    probed = probe_tags(path, ("spotid", "isrc"))
+    return None if probed is None else probed.get("isrc")
+
+
+def measure(
+    read: Callable[[Path], str | None], paths: list[Path], repeat: int
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for path in paths:
+            read(path)
+        best = min(best, perf_counter() - start)
+    return best / len(paths)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        paths = build_library(Path(tmp), args.files)
+        # Read everything once so both readers see a warm page cache
+        for path in paths:
+            path.read_bytes()
+
+        print(f"{'format':<8}{'music_tag':>12}{'probe':>12}")
+        groups = sorted({p.suffix[1:] for p in paths}) + ["all"]
+        for group in groups:
+            selected = [p for p in paths if group in ("all", p.suffix[1:])]
+            old = measure(music_tag_read, selected, args.repeat)
+            new = measure(probe_read, selected, args.repeat)
+            print(f"{group:<8}{old * 1000:>9.2f} ms{new * 1000:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
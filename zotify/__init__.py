@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from threading import Thread
-from typing import Any
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Any, Callable
 from time import time_ns, sleep
 from urllib.parse import urlencode, urlparse, parse_qs
-from limits import storage, strategies, RateLimitItemPerSecond
 import io
 import struct
 import random
@@ -20,7 +23,7 @@ from librespot.core import (
     ApResolver,
     DealerClient,
     EventService,
-    PlayableContentFeeder,
+    PlayableContentFeeder as LibrespotPlayableContentFeeder,
     SearchManager,
     ApiClient as LibrespotApiClient,
     Session as LibrespotSession,
@@ -30,13 +33,18 @@ from librespot.mercury import MercuryClient
 from librespot.metadata import EpisodeId, PlayableId, TrackId, AlbumId, ArtistId, ShowId
 from librespot.proto import Authentication_pb2 as Authentication
 from librespot.proto import Metadata_pb2 as Metadata
+from librespot.proto import StorageResolve_pb2 as StorageResolve
 from librespot.crypto import Packet
 from pkce import generate_code_verifier, get_code_challenge
-from requests import HTTPError, get, post
+from requests import HTTPError, Response, Session as HttpSession
+from requests.exceptions import ConnectionError as HttpConnectionError, Timeout
 
+from zotify.cache import AudioKeyCache, MetadataCache
 from zotify.loader import Loader
+from zotify.network import Http
 from zotify.playable import Episode, Track
-from zotify.utils import Quality, RateLimitMode
+from zotify.ratelimit import AdaptiveLimit, TokenBucket
+from zotify.utils import Quality, RateLimitClass, RateLimitMode
 from zotify.agents import USER_AGENTS
 
 API_URL = "https://api.sp" + "otify.com/v1/"
@@ -72,15 +80,33 @@ SCOPES = [
     "user-top-read",
 ]
 
-RATE_LIMIT_API = "rate_limit_api"
 RATE_LIMIT_MAX_CONSECUTIVE_HITS = 10
-RATE_LIMIT_RESTORE_CONDITION = 15
 RATE_LIMIT_INTERVAL_SECS = 30
 RATE_LIMIT_CALLS_NORMAL = 9
 RATE_LIMIT_CALLS_REDUCED = 3
+RATE_LIMIT_CALLS_MAX = 18
+# Requests of each kind needed per audio key, which scale the audio key budget
+# into the budget of that kind. A track needs up to three metadata requests:
+# the track, its artist for genres and its stream location. Lyrics and Web API
+# requests are at most one per track.
+RATE_LIMIT_CLASSES = {
+    RateLimitClass.METADATA: 3,
+    RateLimitClass.LYRICS: 1,
+    RateLimitClass.WEB_API: 1,
+}
+# All requests together, in multiples of the highest audio key budget
+RATE_LIMIT_GLOBAL_FACTOR = 5
 
 API_MAX_REQUEST_LIMIT = 50
+API_RETRY_ATTEMPTS = 3
+# Seconds before the first retry, doubled for each further retry
+API_RETRY_BACKOFF = 1
+API_RETRY_MAX_DELAY = 30
+API_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 AUDIO_KEY_RETRY_ATTEMPTS = 5
+AUDIO_KEY_RETRY_BACKOFF = 2
+AUDIO_KEY_WORKERS = 4
+STORAGE_RESOLVE_WORKERS = 4
 
 
 class Session(LibrespotSession):
@@ -89,12 +115,18 @@ class Session(LibrespotSession):
         session_builder: LibrespotSession.Builder,
         language: str = "en",
         oauth: OAuth | None = None,
+        metadata_cache: MetadataCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+        audio_key_cache: AudioKeyCache | None = None,
     ) -> None:
         """
         Authenticates user, saves credentials to a file and generates api token.
         Args:
             session_builder: An instance of the Librespot Session builder
             langauge: ISO 639-1 language code
+            metadata_cache: Cache for track, episode, album, artist and show metadata
+            rate_limiter: Limits calls to the API
+            audio_key_cache: Cache for audio keys
         """
         with Loader("Logging in..."):
             super(Session, self).__init__(
@@ -109,17 +141,32 @@ class Session(LibrespotSession):
             )
             self.__oauth = oauth
             self.__language = language
+            self.metadata_cache = (
+                metadata_cache if metadata_cache is not None else MetadataCache()
+            )
+            self.audio_key_cache = (
+                audio_key_cache if audio_key_cache is not None else AudioKeyCache()
+            )
             self.connect()
             self.authenticate(session_builder.login_credentials)
-        self.rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
 
     @staticmethod
-    def from_file(cred_file: Path | str, language: str = "en") -> Session:
+    def from_file(
+        cred_file: Path | str,
+        language: str = "en",
+        metadata_cache: MetadataCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+        audio_key_cache: AudioKeyCache | None = None,
+    ) -> Session:
         """
         Creates session using saved credentials file
         Args:
             cred_file: Path to credentials file
             language: ISO 639-1 language code for API responses
+            metadata_cache: Cache for track, episode, album, artist and show metadata
+            rate_limiter: Limits calls to the API
+            audio_key_cache: Cache for audio keys
         Returns:
             Zotify session
         """
@@ -131,19 +178,31 @@ class Session(LibrespotSession):
             .build()
         )
         session = LibrespotSession.Builder(config).stored_file(str(cred_file))
-        return Session(session, language)
+        return Session(
+            session,
+            language,
+            metadata_cache=metadata_cache,
+            rate_limiter=rate_limiter,
+            audio_key_cache=audio_key_cache,
+        )
 
     @staticmethod
     def from_oauth(
         oauth: OAuth,
         save_file: Path | str | None = None,
         language: str = "en",
+        metadata_cache: MetadataCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+        audio_key_cache: AudioKeyCache | None = None,
     ) -> Session:
         """
         Creates a session using OAuth2
         Args:
             save_file: Path to save login credentials to, optional.
             language: ISO 639-1 language code for API responses
+            metadata_cache: Cache for track, episode, album, artist and show metadata
+            rate_limiter: Limits calls to the API
+            audio_key_cache: Cache for audio keys
         Returns:
             Zotify session
         """
@@ -164,46 +223,117 @@ class Session(LibrespotSession):
             typ=Authentication.AuthenticationType.values()[3],
             auth_data=token.access_token.encode(),
         )
-        return Session(builder, language, oauth)
+        return Session(
+            builder, language, oauth, metadata_cache, rate_limiter, audio_key_cache
+        )
 
-    def __get_playable(
-        self, playable_id: PlayableId, quality: Quality
-    ) -> PlayableContentFeeder.LoadedStream:
+    def __quality_picker(self, quality: Quality) -> VorbisOnlyAudioQuality:
         if quality.value is None:
             quality = Quality.VERY_HIGH if self.is_premium() else Quality.HIGH
-        return self.content_feeder().load(
-            playable_id,
-            VorbisOnlyAudioQuality(quality.value),
-            False,
-            None,
-        )
+        return VorbisOnlyAudioQuality(quality.value)
+
+    def prefetch(self, playable_id: PlayableId, genre: bool = False) -> None:
+        """
+        Fetches the metadata of a track or episode so it's cached when resolved
+        Args:
+            playable_id: ID of the track or episode
+            genre: Also fetch the artist metadata used for the genre tag
+        """
+        if isinstance(playable_id, TrackId):
+            track = self.api().get_metadata_4_track(playable_id)
+            if genre and len(track.artist) > 0:
+                self.api().get_metadata_4_artist(
+                    ArtistId.from_hex(track.artist[0].gid.hex())
+                )
+        else:
+            self.api().get_metadata_4_episode(playable_id)
+
+    def warm(
+        self, playable: Track | Episode, quality: Quality = Quality.AUTO
+    ) -> tuple[bytes, bytes] | None:
+        """
+        Requests the audio key and stream location of a track or episode that's
+        about to be loaded in the background
+        Args:
+            playable: Track or episode from get_track or get_episode
+            quality: Audio quality the track will be loaded at
+        Returns:
+            Track or episode and file IDs to pass to discard, None if nothing
+            was requested
+        """
+        if isinstance(playable, Track):
+            file = self.__quality_picker(quality).get_file(playable.track.file)
+        elif playable.episode.external_url:
+            return None
+        else:
+            file = self.__quality_picker(Quality.NORMAL).get_file(
+                playable.episode.audio
+            )
+        if file is None:
+            return None
+        self.audio_key().request_audio_key(playable.gid, file.file_id)
+        self.content_feeder().request_storage(file.file_id)
+        return playable.gid, file.file_id
 
-    def get_track(self, track_id: str, quality: Quality = Quality.AUTO) -> Track:
+    def discard(self, warmed: tuple[bytes, bytes] | None) -> None:
         """
-        Gets track/episode data and audio stream
+        Forgets the audio key and stream location requested by warm if they
+        weren't used
+        Args:
+            warmed: Value returned by warm
+        """
+        if warmed is not None:
+            self.audio_key().discard(*warmed)
+            self.content_feeder().discard(warmed[1])
+
+    def get_track(self, track_id: str) -> Track:
+        """
+        Gets track data without loading the audio stream
         Args:
             track_id: Base62 ID of track
-            quality: Audio quality of track when downloaded
         Returns:
             Track object
         """
-        return Track(
-            self.__get_playable(TrackId.from_base62(track_id), quality), self.api()
+        track = self.content_feeder().pick_alternative_if_necessary(
+            self.api().get_metadata_4_track(TrackId.from_base62(track_id))
         )
+        if track is None:
+            raise RuntimeError("Cannot get alternative track")
+        return Track(track, self.api())
 
     def get_episode(self, episode_id: str) -> Episode:
         """
-        Gets track/episode data and audio stream
+        Gets episode data without loading the audio stream
         Args:
             episode: Base62 ID of episode
         Returns:
             Episode object
         """
         return Episode(
-            self.__get_playable(EpisodeId.from_base62(episode_id), Quality.NORMAL),
+            self.api().get_metadata_4_episode(EpisodeId.from_base62(episode_id)),
             self.api(),
         )
 
+    def load(self, playable: Track | Episode, quality: Quality = Quality.AUTO) -> None:
+        """
+        Requests the audio key and opens the audio stream of a track or episode
+        Args:
+            playable: Track or episode from get_track or get_episode
+            quality: Audio quality of track when downloaded
+        """
+        if isinstance(playable, Track):
+            loaded = self.content_feeder().load_track(
+                playable.track, self.__quality_picker(quality), False, None
+            )
+        else:
+            loaded = self.content_feeder().load_episode(
+                EpisodeId.from_hex(playable.gid.hex()),
+                self.__quality_picker(Quality.NORMAL),
+                False,
+                None,
+            )
+        playable.load(loaded)
+
     def oauth(self) -> OAuth | None:
         """Returns OAuth service"""
         return self.__oauth
@@ -239,11 +369,9 @@ class Session(LibrespotSession):
             self.__auth_lock.notify_all()
         self.mercury().interested_in("sp" + "otify:user:attributes:update", self)
 
-    def api(self) -> ApiClient:
-        # Check rate limiter before making calls to api
-        self.rate_limiter.apply_limit()
-
-        return super().api()
+    def client(self) -> HttpSession:
+        """Returns the shared HTTP session, also used by librespot for CDN requests"""
+        return Http.session()
 
 
 class ApiClient(LibrespotApiClient):
@@ -259,14 +387,19 @@ class ApiClient(LibrespotApiClient):
         limit: int = 20,
         offset: int = 0,
         raw_url: bool = False,
+        limit_class: RateLimitClass = RateLimitClass.WEB_API,
+        retries: int = API_RETRY_ATTEMPTS,
     ) -> dict[str, Any]:
         """
-        Requests data from API
+        Requests data from API. Throttled requests and server errors are retried
+        after the time given by the server, or with an increasing random delay.
         Args:
             url: API URL and to get data from
             params: parameters to be sent in the request
             limit: The maximum number of items in the response
             offset: The offset of the items returned
+            limit_class: Rate limit budget the request counts against
+            retries: Number of times to retry a failed request
         Returns:
             Dictionary representation of JSON response
         """
@@ -280,19 +413,99 @@ class ApiClient(LibrespotApiClient):
         if not raw_url:
             params["limit"] = limit
             params["offset"] = offset
-
-            response = get(API_URL + url, headers=headers, params=params)
+            url = API_URL + url
         else:
-            response = get(url, headers=headers)
-        data = response.json()
+            params = None
+
+        response = self.__request(
+            lambda: Http.get(url, headers=headers, params=params), limit_class, retries
+        )
+        try:
+            data = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
 
         try:
             raise HTTPError(
                 f"{url}\nAPI Error {data['error']['status']}: {data['error']['message']}"
             )
         except KeyError:
+            self.__session.rate_limiter.succeeded(limit_class)
             return data
 
+    def __request(
+        self,
+        request: Callable[[], Response],
+        limit_class: RateLimitClass,
+        retries: int = API_RETRY_ATTEMPTS,
+    ) -> Response:
+        """
+        Sends a request within its rate limit. Throttled requests, server errors
+        and dropped connections are retried after the time given by the server,
+        or with an increasing random delay.
+        Args:
+            request: Sends the request
+            limit_class: Rate limit budget the request counts against
+            retries: Number of times to retry a failed request
+        Returns:
+            Last response
+        """
+        rate_limiter = self.__session.rate_limiter
+        attempt = 0
+        while True:
+            rate_limiter.apply_limit(limit_class)
+            try:
+                response = request()
+            except (HttpConnectionError, Timeout):
+                if attempt >= retries:
+                    raise
+                response = None
+            else:
+                if response.status_code == 429:
+                    rate_limiter.throttled(limit_class)
+                if (
+                    response.status_code not in API_RETRY_STATUS_CODES
+                    or attempt >= retries
+                ):
+                    return response
+
+            delay = ApiClient.__retry_delay(response, attempt)
+            if delay is None:
+                return response
+            attempt += 1
+            rate_limiter.retried()
+            if response is not None and response.status_code == 429:
+                # Hold back every request of this kind, not only this one
+                rate_limiter.limits[limit_class].pause(delay)
+            else:
+                sleep(delay)
+
+    @staticmethod
+    def __retry_delay(response: Response | None, attempt: int) -> float | None:
+        # Use the server's Retry-After when it gives one, either in seconds or
+        # as a date. Give up if it asks to wait longer than the maximum delay.
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (
+                        parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)
+                    ).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return max(0.0, delay) if delay <= API_RETRY_MAX_DELAY else None
+        # Capped exponential backoff with full jitter so threads don't retry
+        # at the same moment
+        return random.uniform(
+            0, min(API_RETRY_MAX_DELAY, API_RETRY_BACKOFF * 2**attempt)
+        )
+
     def build_request(
         self,
         method: str,
@@ -319,6 +532,26 @@ class ApiClient(LibrespotApiClient):
             .access_token
         )
 
+    def get_metadata_4_track(self, track: TrackId) -> Metadata.Track:
+        """
+
+        :param track: TrackId:
+
+        """
+        proto = Metadata.Track()
+        proto.ParseFromString(self.__get_metadata("track", track.hex_id()))
+        return proto
+
+    def get_metadata_4_episode(self, episode: EpisodeId) -> Metadata.Episode:
+        """
+
+        :param episode: EpisodeId:
+
+        """
+        proto = Metadata.Episode()
+        proto.ParseFromString(self.__get_metadata("episode", episode.hex_id()))
+        return proto
+
     # TODO: Remove when fix is applied to librespot
     def get_metadata_4_album(self, album: AlbumId) -> Metadata.Album:
         """
@@ -326,20 +559,8 @@ class ApiClient(LibrespotApiClient):
         :param album: AlbumId:
 
         """
-        response = self.sendToUrl(
-            "GET",
-            "https://spclient.wg.spotify.com",
-            "/metadata/4/album/{}".format(album.hex_id()),
-            None,
-            None,
-        )
-        ApiClient.StatusCodeException.check_status(response)
-
-        body = response.content
-        if body is None:
-            raise IOError()
         proto = Metadata.Album()
-        proto.ParseFromString(body)
+        proto.ParseFromString(self.__get_metadata("album", album.hex_id()))
         return proto
 
     # TODO: Remove when fix is applied to librespot
@@ -349,19 +570,8 @@ class ApiClient(LibrespotApiClient):
         :param artist: ArtistId:
 
         """
-        response = self.sendToUrl(
-            "GET",
-            "https://spclient.wg.spotify.com",
-            "/metadata/4/artist/{}".format(artist.hex_id()),
-            None,
-            None,
-        )
-        ApiClient.StatusCodeException.check_status(response)
-        body = response.content
-        if body is None:
-            raise IOError()
         proto = Metadata.Artist()
-        proto.ParseFromString(body)
+        proto.ParseFromString(self.__get_metadata("artist", artist.hex_id()))
         return proto
 
     # TODO: Remove when fix is applied to librespot
@@ -371,21 +581,62 @@ class ApiClient(LibrespotApiClient):
         :param show: ShowId:
 
         """
-        response = self.sendToUrl(
-            "GET",
-            "https://spclient.wg.spotify.com",
-            "/metadata/4/show/{}".format(show.hex_id()),
-            None,
-            None,
-        )
-        ApiClient.StatusCodeException.check_status(response)
-        body = response.content
-        if body is None:
-            raise IOError()
         proto = Metadata.Show()
-        proto.ParseFromString(body)
+        proto.ParseFromString(self.__get_metadata("show", show.hex_id()))
         return proto
 
+    def __get_metadata(self, kind: str, hex_id: str) -> bytes:
+        def fetch() -> bytes:
+            # Only requests that miss the cache count against the rate limit
+            response = self.__limited(
+                lambda: self.sendToUrl(
+                    "GET",
+                    "https://spclient.wg.spotify.com",
+                    "/metadata/4/{}/{}".format(kind, hex_id),
+                    None,
+                    None,
+                )
+            )
+            ApiClient.StatusCodeException.check_status(response)
+            body = response.content
+            if body is None:
+                raise IOError()
+            return body
+
+        # Names are localized, so each language is cached separately
+        return self.__session.metadata_cache.get(
+            kind, f"{hex_id}:{self.__session.language()}", fetch
+        )
+
+    def send(
+        self,
+        method: str,
+        suffix: str,
+        headers: dict[str, str] | None,
+        body: bytes | None,
+    ) -> Response:
+        """
+        Sends a request to the client API, eg. for playlists and stream
+        locations. Requests count against the metadata rate limit, and are
+        retried like Web API requests when throttled or on server errors.
+        Args:
+            method: HTTP method
+            suffix: Path of the endpoint
+            headers: Extra request headers
+            body: Request body
+        Returns:
+            Response
+        """
+        return self.__limited(
+            lambda: super(ApiClient, self).send(method, suffix, headers, body)
+        )
+
+    def __limited(self, request: Callable[[], Response]) -> Response:
+        response = self.__request(request, RateLimitClass.METADATA)
+        if response.ok:
+            self.__session.rate_limiter.succeeded(RateLimitClass.METADATA)
+        return response
+
 
 class TokenProvider(LibrespotTokenProvider):
     def __init__(self, session: Session):
@@ -479,7 +730,7 @@ class OAuth:
                 "refresh_token": code,
                 "client_id": CLIENT_ID,
             }
-        response = post(token_url, headers=headers, data=body)
+        response = Http.post(token_url, headers=headers, data=body)
         if response.status_code != 200:
             raise IOError(
                 f"Error fetching token: {response.status_code}, {response.text}"
@@ -539,80 +790,269 @@ class OAuth:
 
 class RateLimiter:
     consecutive_hits: int = 0
-    last_server_limit_hit: int = 0
-    track_count: int = 0
+    __counter_lock = Lock()
 
     rate_limits = {
-        RateLimitMode.NORMAL: RateLimitItemPerSecond(
-            RATE_LIMIT_CALLS_NORMAL, RATE_LIMIT_INTERVAL_SECS
-        ),
-        RateLimitMode.REDUCED: RateLimitItemPerSecond(
-            RATE_LIMIT_CALLS_REDUCED, RATE_LIMIT_INTERVAL_SECS
-        ),
+        RateLimitMode.NORMAL: RATE_LIMIT_CALLS_NORMAL,
+        RateLimitMode.REDUCED: RATE_LIMIT_CALLS_REDUCED,
     }
 
-    def __init__(self):
-        self.storage = storage.MemoryStorage()
-        self.moving_window = strategies.MovingWindowRateLimiter(self.storage)
-        self.mode = RateLimitMode.NORMAL
-        self.rate_limit = RateLimiter.rate_limits[self.mode]
-
-    def check(self):
-        return self.moving_window.test(self.rate_limit, RATE_LIMIT_API)
+    def __init__(
+        self,
+        floor: int = RATE_LIMIT_CALLS_REDUCED,
+        ceiling: int = RATE_LIMIT_CALLS_MAX,
+    ):
+        """
+        Limits requests to the server. Each kind of request has its own adaptive
+        budget so heavy use of one can't starve the others, and all of them
+        share a global cap.
+        Args:
+            floor: Lowest number of audio key requests per interval, other
+                kinds of request scale from it
+            ceiling: Highest number of audio key requests per interval, other
+                kinds of request and the global cap scale from it
+        """
+        self.global_limit = TokenBucket(
+            ceiling * RATE_LIMIT_GLOBAL_FACTOR, RATE_LIMIT_INTERVAL_SECS
+        )
+        self.limits = {
+            RateLimitClass.AUDIO_KEY: AdaptiveLimit(
+                RATE_LIMIT_CALLS_NORMAL, floor, ceiling, RATE_LIMIT_INTERVAL_SECS
+            )
+        }
+        for limit_class, factor in RATE_LIMIT_CLASSES.items():
+            self.limits[limit_class] = AdaptiveLimit(
+                RATE_LIMIT_CALLS_NORMAL * factor,
+                floor * factor,
+                ceiling * factor,
+                RATE_LIMIT_INTERVAL_SECS,
+            )
+        self.global_waited = 0.0
+        self.cooldowns = 0
+        self.retries = 0
+        self.__lock = Lock()
+
+    @property
+    def mode(self) -> RateLimitMode:
+        if self.limits[RateLimitClass.AUDIO_KEY].rate >= RATE_LIMIT_CALLS_NORMAL:
+            return RateLimitMode.NORMAL
+        return RateLimitMode.REDUCED
+
+    @property
+    def tokens(self) -> float:
+        """Number of requests that can be made now within the global cap"""
+        return self.global_limit.tokens
+
+    @property
+    def waiting(self) -> int:
+        """Number of threads waiting for the global cap"""
+        return self.global_limit.waiting + sum(
+            limit.waiting for limit in self.limits.values()
+        )
 
-    def hit(self):
-        self.moving_window.hit(self.rate_limit, RATE_LIMIT_API)
+    @property
+    def waited(self) -> float:
+        """Total seconds spent waiting for permits"""
+        return self.global_waited + sum(limit.waited for limit in self.limits.values())
 
     def set_mode(self, mode: RateLimitMode):
-        self.mode = mode
-        self.rate_limit = RateLimiter.rate_limits[self.mode]
+        self.limits[RateLimitClass.AUDIO_KEY].set_rate(RateLimiter.rate_limits[mode])
 
-    def apply_limit(self):
-        while not self.check():
-            sleep(1)
+    def succeeded(self, limit_class: RateLimitClass) -> None:
+        """Raises the rate of a kind of request after a successful call"""
+        self.limits[limit_class].succeeded()
 
-        self.hit()
+    def throttled(self, limit_class: RateLimitClass) -> None:
+        """Cuts the rate of a kind of request after the server throttled it"""
+        self.limits[limit_class].throttled()
 
-    def handle_server_limit_hit(self, check_consec: bool = False):
-        RateLimiter.last_server_limit_hit = RateLimiter.track_count
+    def retried(self) -> None:
+        """Counts a request that's being retried"""
+        with self.__lock:
+            self.retries += 1
 
+    def apply_limit(self, limit_class: RateLimitClass) -> float:
+        """
+        Waits until a request is allowed. The budget of the kind of request is
+        waited on first so requests held back by it don't hold up the others
+        in the global queue.
+        Args:
+            limit_class: Kind of request
+        Returns:
+            Seconds spent waiting
+        """
+        waited = self.limits[limit_class].acquire()
+        global_waited = self.global_limit.acquire()
+        with self.__lock:
+            self.global_waited += global_waited
+        return waited + global_waited
+
+    def handle_server_limit_hit(self, check_consec: bool = False):
         # Consecutive hits are counted per track. Do not update if
         # called within get_audio_key method
         if check_consec is True:
-            RateLimiter.consecutive_hits += 1
+            with RateLimiter.__counter_lock:
+                RateLimiter.consecutive_hits += 1
 
-            # Exit program if rate limit hit cutoff is reached
-            if RateLimiter.consecutive_hits > RATE_LIMIT_MAX_CONSECUTIVE_HITS:
-                raise Exception("EX02: Server too busy or down.")
+                # Exit program if rate limit hit cutoff is reached
+                if RateLimiter.consecutive_hits > RATE_LIMIT_MAX_CONSECUTIVE_HITS:
+                    raise Exception("EX02: Server too busy or down.")
 
-        # Reduce internal rate limiter
-        if self.mode == RateLimitMode.NORMAL:
-            self.set_mode(RateLimitMode.REDUCED)
-
-        # Sleep for one interval
-        sleep(RATE_LIMIT_INTERVAL_SECS)
+        # Hold back audio key requests for one interval. Only threads that
+        # need an audio key wait, so other requests and work in progress
+        # carry on. The rate was already cut when the request first failed.
+        with self.__lock:
+            self.cooldowns += 1
+        self.limits[RateLimitClass.AUDIO_KEY].pause(RATE_LIMIT_INTERVAL_SECS)
 
     def clear_consec_hits(self):
-        RateLimiter.consecutive_hits = 0
+        with RateLimiter.__counter_lock:
+            RateLimiter.consecutive_hits = 0
 
-    def check_restore_condition(self, count: int):
-        # Save current track count
-        RateLimiter.track_count = count
 
-        if (
-            self.mode == RateLimitMode.REDUCED
-            and (count - self.last_server_limit_hit) > RATE_LIMIT_RESTORE_CONDITION
-        ):
-            self.set_mode(RateLimitMode.NORMAL)
-            sleep(RATE_LIMIT_INTERVAL_SECS)
+class PlayableContentFeeder(LibrespotPlayableContentFeeder):
+    def __init__(self, session: Session):
+        """
+        Loads tracks and episodes. Stream locations can be resolved ahead of
+        time so loading doesn't wait for them.
+        Args:
+            session: Session to send requests with
+        """
+        super().__init__(session)
+        self.__pool = ThreadPoolExecutor(
+            STORAGE_RESOLVE_WORKERS, thread_name_prefix="storage-resolve"
+        )
+        self.__pending: dict[bytes, Future] = {}
+        self.__pending_lock = Lock()
+
+    def request_storage(self, file_id: bytes) -> Future:
+        """
+        Starts resolving the CDN location of an audio file without waiting for it
+        Args:
+            file_id: ID of the audio file
+        Returns:
+            Future holding the storage resolve response
+        """
+        with self.__pending_lock:
+            future = self.__pending.get(file_id)
+            if future is None:
+                future = self.__pool.submit(
+                    LibrespotPlayableContentFeeder.resolve_storage_interactive,
+                    self,
+                    file_id,
+                    False,
+                )
+                self.__pending[file_id] = future
+        return future
+
+    def discard(self, file_id: bytes) -> None:
+        """
+        Forgets a location resolved ahead of time
+        Args:
+            file_id: ID of the audio file
+        """
+        with self.__pending_lock:
+            self.__pending.pop(file_id, None)
+
+    def resolve_storage_interactive(
+        self, file_id: bytes, preload: bool
+    ) -> StorageResolve.StorageResolveResponse:
+        with self.__pending_lock:
+            future = self.__pending.pop(file_id, None)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass  # Resolved again below
+        return super().resolve_storage_interactive(file_id, preload)
 
 
 class AudioKeyManager(LibrespotAudioKeyManager):
+    def __init__(self, session: Session):
+        """
+        Requests audio keys. Several requests are kept in flight at once, each
+        with its own sequence number, retries and backoff.
+        Args:
+            session: Session to send requests with
+        """
+        super().__init__(session)
+        self.__pool = ThreadPoolExecutor(
+            AUDIO_KEY_WORKERS, thread_name_prefix="audio-key"
+        )
+        self.__pending: dict[tuple[bytes, bytes], Future[bytes]] = {}
+        self.__pending_lock = Lock()
+        # Keys requested this run, later requests for them aren't cache hits
+        self.__requested: set[tuple[bytes, bytes]] = set()
+        self.cache_hits = 0
+
     def get_audio_key(
         self, gid: bytes, file_id: bytes, retry_attempts: int = AUDIO_KEY_RETRY_ATTEMPTS
+    ) -> bytes:
+        """
+        Gets an audio key, waiting for a request already in flight if the key
+        was requested ahead of time
+        Args:
+            gid: ID of the track or episode
+            file_id: ID of the audio file
+            retry_attempts: Number of times to retry a failed request
+        Returns:
+            AES key of the audio file
+        """
+        future = self.request_audio_key(gid, file_id, retry_attempts)
+        try:
+            return future.result()
+        finally:
+            self.discard(gid, file_id)
+
+    def request_audio_key(
+        self, gid: bytes, file_id: bytes, retry_attempts: int = AUDIO_KEY_RETRY_ATTEMPTS
+    ) -> Future[bytes]:
+        """
+        Starts requesting an audio key without waiting for it. Cached keys are
+        returned at once and requesting a key that's already being requested
+        returns the same request.
+        Args:
+            gid: ID of the track or episode
+            file_id: ID of the audio file
+            retry_attempts: Number of times to retry a failed request
+        Returns:
+            Future holding the AES key of the audio file
+        """
+        key = self.__session.audio_key_cache.get(gid, file_id)
+        with self.__pending_lock:
+            first = (gid, file_id) not in self.__requested
+            self.__requested.add((gid, file_id))
+            if key is not None:
+                if first:
+                    self.cache_hits += 1
+                future = Future()
+                future.set_result(key)
+                return future
+            future = self.__pending.get((gid, file_id))
+            if future is None:
+                future = self.__pool.submit(
+                    self.__fetch_audio_key, gid, file_id, retry_attempts
+                )
+                self.__pending[(gid, file_id)] = future
+        return future
+
+    def discard(self, gid: bytes, file_id: bytes) -> None:
+        """
+        Forgets a key requested ahead of time, a request in flight still
+        finishes
+        Args:
+            gid: ID of the track or episode
+            file_id: ID of the audio file
+        """
+        with self.__pending_lock:
+            self.__pending.pop((gid, file_id), None)
+
+    def __fetch_audio_key(
+        self, gid: bytes, file_id: bytes, retry_attempts: int
     ) -> bytes:
         attempts = 0
         while True:
+            self.__session.rate_limiter.apply_limit(RateLimitClass.AUDIO_KEY)
             seq: int
             with self.__seq_holder_lock:
                 seq = self.__seq_holder
@@ -623,20 +1063,62 @@ class AudioKeyManager(LibrespotAudioKeyManager):
             out.write(struct.pack(">i", seq))
             out.write(self.__zero_short)
             out.seek(0)
-            self.__session.send(Packet.Type.request_key, out.read())
+            # Register callback before sending so a fast response isn't dropped
             callback = AudioKeyManager.SyncCallback(self)
             self.__callbacks[seq] = callback
+            self.__session.send(Packet.Type.request_key, out.read())
             key = callback.wait_response()
+            self.__callbacks.pop(seq, None)
             if key is not None:
-                break
+                self.__session.rate_limiter.succeeded(RateLimitClass.AUDIO_KEY)
+                self.__session.audio_key_cache.put(gid, file_id, key)
+                return key
 
             attempts += 1
             if attempts > retry_attempts:
+                # Failed requests aren't kept so the key can be requested again
+                self.discard(gid, file_id)
                 raise Exception("EX01: Failed fetching audio key!")
 
-            # Multiple attempts mean server rate limit was hit
-            self.__session.rate_limiter.handle_server_limit_hit()
+            # Multiple attempts mean server rate limit was hit. The rate is
+            # cut once per failed request, not per attempt. Only this request
+            # backs off, other keys are still requested at the reduced rate.
+            if attempts == 1:
+                self.__session.rate_limiter.throttled(RateLimitClass.AUDIO_KEY)
+            sleep(
+                random.uniform(
+                    0,
+                    min(
+                        RATE_LIMIT_INTERVAL_SECS,
+                        AUDIO_KEY_RETRY_BACKOFF * 2 ** (attempts - 1),
+                    ),
+                )
+            )
+
+    class SyncCallback(LibrespotAudioKeyManager.Callback):
+        """
+        Waits for a single audio key response. Unlike the librespot callback
+        each instance has its own queue so concurrent requests can't receive
+        each other's keys.
+        """
+
+        def __init__(self, audio_key_manager: AudioKeyManager):
+            self.__audio_key_manager = audio_key_manager
+            self.__reference: Queue[bytes | None] = Queue(maxsize=1)
 
-            # Use the same rate limiter used for api calls
-            self.__session.rate_limiter.apply_limit()
-        return key
+        def key(self, key: bytes) -> None:
+            self.__reference.put(key)
+
+        def error(self, code: int) -> None:
+            self.__audio_key_manager.logger.fatal(
+                "Audio key error, code: {}".format(code)
+            )
+            self.__reference.put(None)
+
+        def wait_response(self) -> bytes | None:
+            try:
+                return self.__reference.get(
+                    timeout=LibrespotAudioKeyManager.audio_key_request_timeout
+                )
+            except Empty:
+                return None
@@ -105,6 +105,11 @@ def main():
         nargs="+",
         help="Search for a specific track, album, playlist, artist or podcast",
     )
+    group.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Scan the library folders to rebuild the library index and exit.",
+    )
 
     for k, v in CONFIG_VALUES.items():
         if v["type"] == bool:
@@ -1,19 +1,65 @@
 from argparse import Namespace
+from dataclasses import dataclass
+from os import cpu_count
 from pathlib import Path
+from queue import Queue
+from threading import BoundedSemaphore, Lock
 from typing import Any
 
-from zotify import OAuth, Session
+from librespot.metadata import EpisodeId, TrackId
+
+from zotify import OAuth, RateLimiter, Session
+from zotify.cache import (
+    MEMORY_CACHE_ENTRIES,
+    AudioKeyCache,
+    ImageCache,
+    MetadataCache,
+)
 from zotify.collections import Album, Artist, Collection, Episode, Playlist, Show, Track
 from zotify.config import Config
-from zotify.file import TranscodingError
+from zotify.file import LocalFile, PlaylistFile, TranscodingError
+from zotify.library import LibraryIndex, LibraryScan
 from zotify.loader import Loader
 from zotify.logger import LogChannel, Logger
-from zotify.utils import AudioFormat, PlayableType
+from zotify.network import Http
+from zotify.pipeline import Pipeline, Stage
+from zotify.playable import Playable
+from zotify.utils import AudioFormat, PlayableData, PlayableType
+
+LYRICS_WORKERS = 8
+PREFETCH_LIMIT = MEMORY_CACHE_ENTRIES // 4
 
 
 class ParseError(ValueError): ...
 
 
+class Total:
+    def __init__(self):
+        """
+        Number of playables found so far, grows while collections are resolved
+        """
+        self.count = 0
+        self.final = False
+
+    def __str__(self) -> str:
+        return str(self.count) if self.final else f"{self.count}+"
+
+
+@dataclass
+class DownloadJob:
+    playable: PlayableData
+    count: int
+    total: Total
+    playlist_file: PlaylistFile | None
+    index: int
+    lookahead: bool = False
+    warmed: tuple[bytes, bytes] | None = None
+    track: Playable | None = None
+    output: Path | None = None
+    file: LocalFile | None = None
+    transcoded: bool = False
+
+
 class Selection:
     def __init__(self, session: Session):
         self.__session = session
@@ -206,19 +252,63 @@ class App:
         self.__config = Config(args)
         self.__existing = {}
         self.__duplicates = {}
+        self.__positions: Queue[int] = Queue()
+        self.__index: LibraryIndex | None = None
+        self.__library: LibraryIndex | LibraryScan | None = None
+        self.__scans: dict[Path, LibraryScan] = {}
+        self.__keys_saved = 0
+        self.__keys_saved_lock = Lock()
+        # Tracks warmed and not yet loaded
+        self.__lookahead = BoundedSemaphore(max(1, self.__config.lookahead))
         Logger(self.__config)
 
+        if args.rebuild_index:
+            self.__index = LibraryIndex(self.__config.index_path)
+            self.rebuild_index()
+            exit(0)
+
+        Http(self.__config)
+        self.__images = ImageCache(
+            self.__config.cache_path.joinpath("images")
+            if self.__config.cover_art_cache
+            else None
+        )
+
         # Create session
+        metadata_cache = MetadataCache(
+            self.__config.cache_path.joinpath("metadata.db"),
+            self.__config.metadata_cache_ttl * 3600,
+            self.__config.metadata_cache_size * 1024 * 1024,
+        )
+        rate_limiter = RateLimiter(
+            self.__config.rate_limit_min, self.__config.rate_limit_max
+        )
+        audio_key_cache = AudioKeyCache(
+            self.__config.cache_path.joinpath("audio_keys.db"),
+            (
+                self.__config.audio_key_cache_ttl * 3600
+                if self.__config.audio_key_cache
+                else 0
+            ),
+        )
         if args.username != "" and args.token != "":
             oauth = OAuth(args.username)
             oauth.set_token(args.token, OAuth.RequestType.REFRESH)
             self.__session = Session.from_oauth(
-                oauth, self.__config.credentials_path, self.__config.language
+                oauth,
+                self.__config.credentials_path,
+                self.__config.language,
+                metadata_cache,
+                rate_limiter,
+                audio_key_cache,
             )
         elif self.__config.credentials_path.is_file():
             self.__session = Session.from_file(
                 self.__config.credentials_path,
                 self.__config.language,
+                metadata_cache,
+                rate_limiter,
+                audio_key_cache,
             )
         else:
             username = args.username
@@ -228,7 +318,12 @@ class App:
             auth_url = oauth.auth_interactive()
             print(f"\nClick on the following link to login:\n{auth_url}")
             self.__session = Session.from_oauth(
-                oauth, self.__config.credentials_path, self.__config.language
+                oauth,
+                self.__config.credentials_path,
+                self.__config.language,
+                metadata_cache,
+                rate_limiter,
+                audio_key_cache,
             )
 
         # Get items to download
@@ -240,8 +335,13 @@ class App:
                 Logger.log(LogChannel.ERRORS, str(e))
                 exit(1)
         if len(collections) > 0:
-            with Loader("Scanning collections..."):
-                self.scan(collections, args.match)
+            if self.__config.lyrics_only and not self.__config.lyrics_file:
+                Logger.log(
+                    LogChannel.WARNINGS,
+                    "Cannot use --lyrics-only parameter if --lyrics-file is false",
+                )
+                exit(0)
+            self.scan(collections, args.match)
             self.download_all(collections)
         else:
             Logger.log(LogChannel.WARNINGS, "there is nothing to do")
@@ -276,6 +376,8 @@ class App:
         exit(0)
 
     def parse(self, links: list[str]) -> list[Collection]:
+        # Collections are only resolved when they're downloaded
+        api = self.__session.api()
         collections: list[Collection] = []
         for link in links:
             link = link.rsplit("?", 1)[0]
@@ -295,204 +397,480 @@ class App:
                 "playlist": Playlist,
             }
             try:
-                collections.append(
-                    collection_types[id_type](_id, self.__session.api(), self.__config)
-                )
-            except ValueError:
+                collections.append(collection_types[id_type](_id, api, self.__config))
+            except (KeyError, ValueError):
                 raise ParseError(f'Unsupported content type "{id_type}"')
         return collections
 
+    def rebuild_index(self) -> None:
+        count = self.__index.rebuild(self.__libraries(), self.__config.scan_workers)
+        Logger.log(LogChannel.SUMMARY, f"Indexed {count} files")
+
+    def __libraries(self) -> list[Path]:
+        return [
+            self.__config.album_library,
+            self.__config.playlist_library,
+            self.__config.podcast_library,
+        ]
+
     def scan(self, collections: list[Collection], match: bool):
+        # Downloads are always added so folders the index has scanned stay
+        # complete, whether or not this run skips anything
+        if self.__config.library_index:
+            self.__index = LibraryIndex(self.__config.index_path)
+
+        # Lyrics are saved for every track, downloaded before or not
+        if self.__config.lyrics_only:
+            return
+
         if self.__config.replace_existing:
             return
 
         if match:
-            for collection in collections:
-                collection.get_match()
+            # Matching needs the whole collection
+            with Loader("Matching files..."):
+                for collection in collections:
+                    collection.resolve_all()
+                    collection.get_match()
+
+        if not (self.__config.skip_previous or self.__config.skip_duplicates):
+            return
+
+        # Read the library once for all collections. Each library folder is
+        # only indexed once, after that the index is kept up to date as tracks
+        # are downloaded. Matching retags files so they are reindexed.
+        if self.__index is not None:
+            roots = (
+                self.__libraries()
+                if match
+                else self.__index.unindexed(self.__libraries())
+            )
+            if len(roots) > 0:
+                self.__index.rebuild(roots, self.__config.scan_workers)
+            self.__library = self.__index
+        elif self.__config.skip_duplicates:
+            self.__library = LibraryScan(self.__libraries(), self.__config.scan_workers)
+        # Otherwise each collection's folder is scanned once its path is known
+
+    def check(self, collection: Collection, playables: list[PlayableData]) -> None:
+        """
+        Marks previously downloaded and duplicated playables of a collection
+        Args:
+            collection: Collection the playables were resolved from
+            playables: Playables to check
+        """
+        if (
+            self.__config.replace_existing
+            or self.__config.lyrics_only
+            or not (self.__config.skip_previous or self.__config.skip_duplicates)
+        ):
+            return
+
+        library = self.__library
+        if library is None:
+            try:
+                if collection.path is None:
+                    collection.set_path()
+            except IndexError as err:
+                Logger.log(
+                    LogChannel.WARNINGS, f"{err} Cannot scan for existing tracks"
+                )
+                return
+            library = self.__scans.get(collection.path)
+            if library is None:
+                library = LibraryScan([collection.path], self.__config.scan_workers)
+                self.__scans[collection.path] = library
 
         if self.__config.skip_previous:
-            for collection in collections:
-                try:
-                    existing = collection.get_existing(
-                        self.__config.audio_format.value.ext
-                    )
-                    self.__existing.update(existing)
-                except IndexError as err:
-                    Logger.log(
-                        LogChannel.WARNINGS, f"{err} Cannot scan for existing tracks"
-                    )
+            try:
+                existing = collection.get_existing(
+                    self.__config.audio_format.value.ext, library, playables
+                )
+                self.__existing.update(existing)
+            except IndexError as err:
+                Logger.log(
+                    LogChannel.WARNINGS, f"{err} Cannot scan for existing tracks"
+                )
 
         if self.__config.skip_duplicates:
-            for collection in collections:
-                try:
-                    duplicates = collection.get_duplicates(
-                        self.__config.audio_format.value.ext,
-                        self.__config.album_library,
-                        self.__config.playlist_library,
-                        self.__config.podcast_library,
-                    )
-                    self.__duplicates.update(duplicates)
-                except IndexError as err:
-                    Logger.log(
-                        LogChannel.WARNINGS, f"{err} Cannot scan for duplicate tracks"
-                    )
+            try:
+                duplicates = collection.get_duplicates(
+                    self.__config.audio_format.value.ext,
+                    self.__config.album_library,
+                    self.__config.playlist_library,
+                    self.__config.podcast_library,
+                    library,
+                    playables,
+                )
+                self.__duplicates.update(duplicates)
+            except IndexError as err:
+                Logger.log(
+                    LogChannel.WARNINGS, f"{err} Cannot scan for duplicate tracks"
+                )
 
     def download_all(self, collections: list[Collection]) -> None:
         count = 0
-        total = sum(len(c.playables) for c in collections)
-        for collection in collections:
-            if self.__config.create_playlist_file and not isinstance(
-                collection, (Track, Episode)
-            ):
-                if collection.path is None:
-                    collection.set_path()
-                if isinstance(collection, Artist):
-                    # Make sure playlist file goes in the requested artist's folder as
-                    # discovery sometimes includes other artists as main contributor
-                    playlist_file = Path(
-                        f"{self.__config.album_library}/{collection.name}/{collection.name}.m3u8"
+        total = Total()
+
+        # Progress bar positions, one per download worker
+        for position in range(max(1, self.__config.workers)):
+            self.__positions.put(position)
+
+        if self.__config.lyrics_only:
+            # Lyrics only need metadata, so no track is ever loaded. Requests
+            # are small, so more run at once than downloads.
+            stages = [
+                Stage("prefetch", self.__prefetch, LYRICS_WORKERS),
+                Stage("resolve", self.__resolve, LYRICS_WORKERS, PREFETCH_LIMIT),
+            ]
+        else:
+            stages = self.__download_stages()
+        with Pipeline(stages, self.__drop) as pipeline:
+            # Collections are resolved while earlier tracks download, the
+            # total grows as more playables are found
+            for collection in collections:
+                playlist_file = None
+                index = 0
+                for playables in collection.stream():
+                    total.count += len(playables)
+                    self.check(collection, playables)
+                    if (
+                        index == 0
+                        and self.__config.create_playlist_file
+                        and not self.__config.lyrics_only
+                        and not isinstance(collection, (Track, Episode))
+                    ):
+                        playlist_file = self.__playlist_file(collection)
+                    for playable in playables:
+                        count += 1
+                        pipeline.put(
+                            DownloadJob(playable, count, total, playlist_file, index)
+                        )
+                        index += 1
+                for error in collection.errors:
+                    Logger.log(
+                        LogChannel.WARNINGS,
+                        f'Skipping {error.type} "{error.id}": {error.message}',
                     )
-                else:
-                    playlist_file = Path(f"{collection.path}/{collection.name}.m3u8")
-                playlist_file.parent.mkdir(parents=True, exist_ok=True)
-                with open(playlist_file, "w", encoding="utf-8") as f:
-                    f.write("#EXTM3U\n")
+            total.final = True
+
+        self.summary()
+
+    def summary(self) -> None:
+        rate_limiter = self.__session.rate_limiter
+        Logger.log(
+            LogChannel.SUMMARY,
+            f"{Http.requests} HTTP requests over {Http.connections} connections",
+        )
+        waits = ", ".join(
+            f"{limit_class.value} {limit.waited:.1f}s"
+            for limit_class, limit in rate_limiter.limits.items()
+        )
+        waits += f", global cap {rate_limiter.global_waited:.1f}s"
+        Logger.log(
+            LogChannel.SUMMARY,
+            f"Waited {rate_limiter.waited:.1f}s for rate limits ({waits}), "
+            f"{rate_limiter.cooldowns} cooldowns after server throttling",
+        )
+        Logger.log(LogChannel.SUMMARY, f"{rate_limiter.retries} API requests retried")
+        Logger.log(
+            LogChannel.SUMMARY,
+            f"{self.__session.audio_key().cache_hits} audio keys from cache, "
+            f"{self.__keys_saved} saved by skipping tracks before loading",
+        )
+
+    def __download_stages(self) -> list[Stage]:
+        # Queue bounds limit how many loaded streams and temp files exist at once
+        # Metadata is fetched ahead of resolving so the content feeder reads it
+        # from the cache. The prefetch is kept within the in-memory cache.
+        # Tracks are resolved from metadata alone, so skipped tracks never
+        # request an audio key. Audio keys and stream locations expire, so
+        # they're only requested for the few tracks about to be loaded. The
+        # lookahead semaphore bounds those tracks, so the load queue doesn't
+        # need to.
+        return [
+            Stage("prefetch", self.__prefetch, self.__config.workers),
+            Stage("resolve", self.__resolve, self.__config.workers, PREFETCH_LIMIT),
+            Stage("warm", self.__warm, self.__config.workers, self.__config.queue_size),
+            Stage(
+                "load",
+                self.__load,
+                self.__config.workers,
+                0 if self.__config.lookahead > 0 else self.__config.queue_size,
+            ),
+            Stage(
+                "stream",
+                self.__stream,
+                self.__config.workers,
+                self.__config.queue_size,
+            ),
+            Stage(
+                "transcode",
+                self.__transcode,
+                self.__config.transcode_workers or cpu_count() or 1,
+                self.__config.queue_size,
+            ),
+            Stage(
+                "tag",
+                self.__tag,
+                self.__config.tag_workers,
+                self.__config.queue_size,
+            ),
+            Stage("finalize", self.__finalize, 1, self.__config.queue_size),
+        ]
+
+    def __playlist_file(self, collection: Collection) -> PlaylistFile:
+        if collection.path is None:
+            collection.set_path()
+        if isinstance(collection, Artist):
+            # Make sure playlist file goes in the requested artist's folder as
+            # discovery sometimes includes other artists as main contributor
+            return PlaylistFile(
+                Path(
+                    f"{self.__config.album_library}/{collection.name}/{collection.name}.m3u8"
+                )
+            )
+        return PlaylistFile(Path(f"{collection.path}/{collection.name}.m3u8"))
 
-            for playable in collection.playables:
-                count += 1
+    def __prefetch(self, job: DownloadJob) -> DownloadJob:
+        playable = job.playable
+        if playable.existing or playable.duplicate:
+            return job
+        try:
+            if playable.type == PlayableType.TRACK:
+                self.__session.prefetch(
+                    TrackId.from_base62(playable.id), self.__config.save_genre
+                )
+            elif playable.type == PlayableType.EPISODE:
+                self.__session.prefetch(EpisodeId.from_base62(playable.id))
+        except Exception:
+            pass  # Fetched again and reported when resolving
+        return job
 
-                # Skip duplicates and previously downloaded
-                if playable.duplicate:
-                    Logger.log(
-                        LogChannel.SKIPS,
-                        f'Skipping "{self.__duplicates[playable.id]}": Duplicated from another collection',
-                    )
-                    continue
-                if playable.existing:
-                    Logger.log(
-                        LogChannel.SKIPS,
-                        f'Skipping "{self.__existing[playable.id]}": Previously downloaded',
-                    )
-                    continue
+    def __resolve(self, job: DownloadJob) -> DownloadJob | None:
+        playable = job.playable
 
-                # Get track data
-                if playable.type == PlayableType.TRACK:
-                    try:
-                        with Loader("Adjusting rate limiter..."):
-                            self.__session.rate_limiter.check_restore_condition(count)
-                        with Loader("Fetching track..."):
-                            track = self.__session.get_track(
-                                playable.id, self.__config.download_quality
-                            )
-                    except Exception as err:
-                        self.handle_exception(err, playable.type, count, skip=True)
-                        continue
-                elif playable.type == PlayableType.EPISODE:
-                    try:
-                        with Loader("Adjusting rate limiter..."):
-                            self.__session.rate_limiter.check_restore_condition(count)
-                        with Loader("Fetching episode..."):
-                            track = self.__session.get_episode(playable.id)
-                    except Exception as err:
-                        self.handle_exception(err, playable.type, count, skip=True)
-                        continue
-                else:
-                    Logger.log(
-                        LogChannel.SKIPS,
-                        f'Download Error: Unknown playable content "{playable.type}"',
-                    )
-                    continue
+        # Skip duplicates and previously downloaded
+        if playable.duplicate:
+            Logger.log(
+                LogChannel.SKIPS,
+                f'Skipping "{self.__duplicates[playable.id]}": Duplicated from another collection',
+            )
+            return None
+        if playable.existing:
+            Logger.log(
+                LogChannel.SKIPS,
+                f'Skipping "{self.__existing[playable.id]}": Previously downloaded',
+            )
+            return None
 
-                # Create download location and generate file name
-                track.metadata.extend(playable.metadata)
-                if self.__config.save_genre:
-                    track.add_genre()
-                if self.__config.all_artists:
-                    try:
-                        track.add_all_artists()
-                    except AttributeError:
-                        pass  # Episode
-                try:
-                    output = track.create_output(
-                        self.__config.audio_format.value.ext,
-                        playable.library,
-                        playable.output_template,
-                        self.__config.replace_existing,
-                    )
-                except FileExistsError:
-                    Logger.log(
-                        LogChannel.SKIPS,
-                        f'Skipping "{track.name}": Already exists at specified output',
-                    )
-                    continue
-
-                # Download lyrics
-                self.download_lyrics(playable, track, output)
-                if self.__config.lyrics_only:
-                    if not self.__config.lyrics_file:
-                        Logger.log(
-                            LogChannel.WARNINGS,
-                            "Cannot use --lyrics-only parameter if --lyrics-file is false",
-                        )
-                        exit(0)
-                    Logger.log(
-                        LogChannel.DOWNLOADS,
-                        f"\nDownloaded {track.name} lyrics ({count}/{total})",
+        # Get track data, the audio stream is loaded once the output is known
+        if playable.type == PlayableType.TRACK:
+            try:
+                track = self.__session.get_track(playable.id)
+            except Exception as err:
+                self.handle_exception(err, playable.type, job.count, skip=True)
+                return None
+        elif playable.type == PlayableType.EPISODE:
+            try:
+                track = self.__session.get_episode(playable.id)
+            except Exception as err:
+                self.handle_exception(err, playable.type, job.count, skip=True)
+                return None
+        else:
+            Logger.log(
+                LogChannel.SKIPS,
+                f'Download Error: Unknown playable content "{playable.type}"',
+            )
+            return None
+
+        # Create download location and generate file name
+        track.metadata.extend(playable.metadata)
+        if self.__config.save_genre:
+            track.add_genre()
+        if self.__config.all_artists:
+            try:
+                track.add_all_artists()
+            except AttributeError:
+                pass  # Episode
+        try:
+            output = track.create_output(
+                self.__config.audio_format.value.ext,
+                playable.library,
+                playable.output_template,
+                # Lyrics are saved next to tracks that were already downloaded
+                self.__config.replace_existing or self.__config.lyrics_only,
+            )
+        except FileExistsError:
+            Logger.log(
+                LogChannel.SKIPS,
+                f'Skipping "{track.name}": Already exists at specified output',
+            )
+            self.__save_key()
+            return None
+
+        # Download lyrics
+        self.download_lyrics(playable, track, output)
+        if self.__config.lyrics_only:
+            Logger.log(
+                LogChannel.DOWNLOADS,
+                f"\nDownloaded {track.name} lyrics ({job.count}/{job.total})",
+            )
+            self.__session.rate_limiter.clear_consec_hits()
+            self.__save_key()
+            return None
+
+        job.track = track
+        job.output = output
+        return job
+
+    def __warm(self, job: DownloadJob) -> DownloadJob:
+        if self.__config.lookahead > 0:
+            # Held until the track is loaded or dropped
+            self.__lookahead.acquire()
+            job.lookahead = True
+            try:
+                job.warmed = self.__session.warm(
+                    job.track, self.__config.download_quality
+                )
+            except Exception:
+                pass  # Requested again and reported when loading
+        return job
+
+    def __load(self, job: DownloadJob) -> DownloadJob | None:
+        try:
+            self.__session.load(job.track, self.__config.download_quality)
+        except Exception as err:
+            self.handle_exception(err, job.playable.type, job.count, skip=True)
+            return None
+        finally:
+            self.__release_lookahead(job)
+        return job
+
+    def __release_lookahead(self, job: DownloadJob) -> None:
+        if job.lookahead:
+            job.lookahead = False
+            self.__lookahead.release()
+
+    def __save_key(self) -> None:
+        # Counts tracks skipped before their audio key was requested
+        with self.__keys_saved_lock:
+            self.__keys_saved += 1
+
+    def __stream(self, job: DownloadJob) -> DownloadJob | None:
+        position = self.__positions.get()
+        try:
+            with Logger.progress(
+                desc=f"({job.count}/{job.total}) {job.track.name}",
+                total=job.track.input_stream.size,
+                position=position,
+            ) as p_bar:
+                if self.__config.stream_transcode and self.__needs_transcode():
+                    job.file = job.track.transcode_audio_stream(
+                        job.output,
+                        self.__config.audio_format,
+                        self.__config.download_quality,
+                        self.__config.transcode_bitrate,
+                        self.__config.ffmpeg_path,
+                        self.__config.ffmpeg_args.split(),
+                        p_bar,
+                        self.__config.download_real_time,
+                        self.__config.chunk_size,
                     )
-                    self.__session.rate_limiter.clear_consec_hits()
-                    continue
-
-                # Download track
-                with Logger.progress(
-                    desc=f"({count}/{total}) {track.name}",
-                    total=track.input_stream.size,
-                ) as p_bar:
-                    file = track.write_audio_stream(
-                        output, p_bar, self.__config.download_real_time
+                    job.transcoded = True
+                else:
+                    job.file = job.track.write_audio_stream(
+                        job.output,
+                        p_bar,
+                        self.__config.download_real_time,
+                        self.__config.chunk_size,
                     )
+        except TranscodingError as e:
+            Logger.log(
+                LogChannel.ERRORS, f'Failed to transcode "{job.track.name}": {e}'
+            )
+            return None
+        finally:
+            self.__positions.put(position)
+        Logger.log(
+            LogChannel.DOWNLOADS,
+            f"\nDownloaded {job.track.name} ({job.count}/{job.total})",
+        )
+        return job
+
+    def __transcode(self, job: DownloadJob) -> DownloadJob:
+        if self.__needs_transcode() and not job.transcoded:
+            try:
+                job.file.transcode(
+                    self.__config.audio_format,
+                    self.__config.download_quality,
+                    self.__config.transcode_bitrate,
+                    True,
+                    self.__config.ffmpeg_path,
+                    self.__config.ffmpeg_args.split(),
+                )
+            except TranscodingError as e:
                 Logger.log(
-                    LogChannel.DOWNLOADS, f"\nDownloaded {track.name} ({count}/{total})"
+                    LogChannel.ERRORS,
+                    f'Failed to transcode "{job.track.name}": {e}',
                 )
+        return job
 
-                # Transcode audio
-                if (
-                    self.__config.audio_format != AudioFormat.VORBIS
-                    or self.__config.ffmpeg_args != ""
-                ):
-                    try:
-                        with Loader("Converting audio..."):
-                            file.transcode(
-                                self.__config.audio_format,
-                                self.__config.download_quality,
-                                self.__config.transcode_bitrate,
-                                True,
-                                self.__config.ffmpeg_path,
-                                self.__config.ffmpeg_args.split(),
-                            )
-                    except TranscodingError as e:
-                        Logger.log(LogChannel.ERRORS, str(e))
-
-                # Write metadata
-                if self.__config.save_metadata:
-                    with Loader("Writing metadata..."):
-                        file.write_metadata(track.metadata)
-                        file.write_cover_art(
-                            track.get_cover_art(self.__config.artwork_size)
-                        )
+    def __needs_transcode(self) -> bool:
+        return (
+            self.__config.audio_format != AudioFormat.VORBIS
+            or self.__config.ffmpeg_args != ""
+        )
 
-                # Remove temp filename
-                file.clean_filename()
-
-                # Reset rate limit counter for every successful download
-                self.__session.rate_limiter.clear_consec_hits()
+    def __tag(self, job: DownloadJob) -> DownloadJob:
+        if self.__config.save_metadata:
+            job.file.write_metadata(job.track.metadata)
+            try:
+                cover_art = job.track.get_cover_art(
+                    self.__config.artwork_size, self.__images
+                )
+            except OSError as e:
+                # Includes request errors
+                Logger.log(
+                    LogChannel.WARNINGS,
+                    f'Failed to download cover art for "{job.track.name}": {e}',
+                )
+            else:
+                job.file.write_cover_art(cover_art)
+        return job
 
-                # Add entry to playlist file
-                if self.__config.create_playlist_file and not isinstance(
-                    collection, (Track, Episode)
-                ):
-                    with open(playlist_file, "a", encoding="utf-8") as f:
-                        f.write(f"#EXTINF:{track.duration},\n")
-                        f.write(f"{output}.{self.__config.audio_format.value.ext}\n")
+    def __finalize(self, job: DownloadJob) -> DownloadJob:
+        # Remove temp filename
+        job.file.clean_filename()
+        if self.__index is not None:
+            try:
+                isrc = next(m.string for m in job.track.metadata if m.name == "isrc")
+            except StopIteration:
+                isrc = None
+            self.__index.add(job.file.path(), job.playable.id, isrc)
+
+        # Reset rate limit counter for every successful download
+        self.__session.rate_limiter.clear_consec_hits()
+
+        # Add entry to playlist file
+        if job.playlist_file is not None:
+            job.playlist_file.add(
+                job.index,
+                job.track.duration,
+                f"{job.output}.{self.__config.audio_format.value.ext}",
+            )
+        return job
+
+    def __drop(self, job: DownloadJob) -> None:
+        self.__release_lookahead(job)
+        self.__session.discard(job.warmed)
+        # Remove what was written of a track that didn't finish
+        if job.file is not None and job.file.path().stem.endswith("_tmp"):
+            job.file.path().unlink(missing_ok=True)
+        # Every position is reported, even skipped ones, so the
+        # playlist file can be written in collection order
+        if job.playlist_file is not None:
+            job.playlist_file.add(job.index)
 
     def handle_exception(
         self,
@@ -526,8 +904,7 @@ class App:
                     f'Failed to save lyrics for "{track.name}": Lyrics are only available to premium users',
                 )
             else:
-                with Loader("Fetching lyrics..."):
-                    try:
-                        track.get_lyrics().save(output)
-                    except FileNotFoundError as e:
-                        Logger.log(LogChannel.SKIPS, str(e))
+                try:
+                    track.get_lyrics().save(output)
+                except FileNotFoundError as e:
+                    Logger.log(LogChannel.SKIPS, str(e))
@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from pathlib import Path
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from typing import Callable
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Random import get_random_bytes
+
+MEMORY_CACHE_ENTRIES = 1024
+MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+# Only cached for the run. Artists and shows list their releases, and tracks
+# and episodes carry file IDs, alternatives and restrictions used to load them,
+# all of which change.
+MEMORY_ONLY_KINDS = {"artist", "episode", "show", "track"}
+
+
+class MetadataCache:
+    def __init__(self, path: Path | None = None, ttl: int = 0, max_size: int = 0):
+        """
+        Caches serialized metadata responses in memory and optionally on disk.
+        Concurrent requests for the same item wait for a single fetch.
+        Args:
+            path: Location of the cache database, None to only cache in memory
+            ttl: Seconds before a cached item is fetched again, 0 to disable the
+            disk cache
+            max_size: Maximum size of the disk cache in bytes, least recently used
+            items are removed first
+        """
+        self.__memory: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self.__lock = Lock()
+        self.__key_locks: dict[tuple[str, str], Lock] = {}
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__db = None
+        if path is not None and ttl > 0:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.__db = connect(path, check_same_thread=False)
+            with self.__lock, self.__db:
+                self.__db.execute(
+                    "CREATE TABLE IF NOT EXISTS metadata ("
+                    "kind TEXT, "
+                    "id TEXT, "
+                    "data BLOB, "
+                    "fetched REAL, "
+                    "accessed REAL, "
+                    "PRIMARY KEY (kind, id))"
+                )
+                self.__db.execute(
+                    "DELETE FROM metadata WHERE fetched < ?", (time() - ttl,)
+                )
+                self.__size = self.__db.execute(
+                    "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM metadata"
+                ).fetchone()[0]
+
+    def get(self, kind: str, key: str, fetch: Callable[[], bytes]) -> bytes:
+        """
+        Gets an item from the cache, fetching it if it's missing or expired
+        Args:
+            kind: Type of item, eg. album
+            key: ID of the item
+            fetch: Called to get the item when it isn't cached
+        Returns:
+            Serialized item
+        """
+        cache_key = (kind, key)
+        with self.__lock:
+            key_lock = self.__key_locks.setdefault(cache_key, Lock())
+
+        with key_lock:
+            data = self.__get_memory(cache_key)
+            if data is None:
+                data = self.__get_disk(cache_key)
+                if data is None:
+                    data = fetch()
+                    self.__put_disk(cache_key, data)
+                self.__put_memory(cache_key, data)
+
+        with self.__lock:
+            self.__key_locks.pop(cache_key, None)
+        return data
+
+    def __get_memory(self, cache_key: tuple[str, str]) -> bytes | None:
+        with self.__lock:
+            data = self.__memory.get(cache_key)
+            if data is not None:
+                self.__memory.move_to_end(cache_key)
+            return data
+
+    def __put_memory(self, cache_key: tuple[str, str], data: bytes) -> None:
+        with self.__lock:
+            self.__memory[cache_key] = data
+            self.__memory.move_to_end(cache_key)
+            while len(self.__memory) > MEMORY_CACHE_ENTRIES:
+                self.__memory.popitem(last=False)
+
+    def __get_disk(self, cache_key: tuple[str, str]) -> bytes | None:
+        if self.__db is None or cache_key[0] in MEMORY_ONLY_KINDS:
+            return None
+        with self.__lock, self.__db:
+            row = self.__db.execute(
+                "SELECT data FROM metadata WHERE kind = ? AND id = ? AND fetched >= ?",
+                (*cache_key, time() - self.__ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self.__db.execute(
+                "UPDATE metadata SET accessed = ? WHERE kind = ? AND id = ?",
+                (time(), *cache_key),
+            )
+            return row[0]
+
+    def __put_disk(self, cache_key: tuple[str, str], data: bytes) -> None:
+        if self.__db is None or cache_key[0] in MEMORY_ONLY_KINDS:
+            return
+        now = time()
+        with self.__lock, self.__db:
+            old = self.__db.execute(
+                "SELECT LENGTH(data) FROM metadata WHERE kind = ? AND id = ?",
+                cache_key,
+            ).fetchone()
+            self.__db.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                (*cache_key, data, now, now),
+            )
+            self.__size += len(data) - (old[0] if old else 0)
+            if self.__max_size > 0 and self.__size > self.__max_size:
+                self.__evict()
+
+    def __evict(self) -> None:
+        # Remove least recently used items until the cache fits
+        rows = self.__db.execute(
+            "SELECT kind, id, LENGTH(data) FROM metadata ORDER BY accessed"
+        ).fetchall()
+        for kind, key, size in rows:
+            if self.__size <= self.__max_size:
+                break
+            self.__db.execute(
+                "DELETE FROM metadata WHERE kind = ? AND id = ?", (kind, key)
+            )
+            self.__size -= size
+
+
+class ImageCache:
+    def __init__(self, path: Path | None = None, max_memory: int = MEMORY_CACHE_BYTES):
+        """
+        Caches images by file ID in memory and optionally on disk. Images never
+        change for a file ID so they don't expire. Concurrent requests for the
+        same image wait for a single download.
+        Args:
+            path: Folder to save images in, None to only cache in memory
+            max_memory: Maximum size of images kept in memory in bytes
+        """
+        self.__memory: OrderedDict[str, bytes] = OrderedDict()
+        self.__memory_size = 0
+        self.__max_memory = max_memory
+        self.__lock = Lock()
+        self.__key_locks: dict[str, Lock] = {}
+        self.__path = path
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+
+    def get(self, file_id: str, fetch: Callable[[], bytes]) -> bytes:
+        """
+        Gets an image from the cache, downloading it if it's missing
+        Args:
+            file_id: Hex ID of the image file
+            fetch: Called to download the image when it isn't cached
+        Returns:
+            Image data
+        """
+        with self.__lock:
+            key_lock = self.__key_locks.setdefault(file_id, Lock())
+
+        with key_lock:
+            with self.__lock:
+                data = self.__memory.get(file_id)
+                if data is not None:
+                    self.__memory.move_to_end(file_id)
+            if data is None:
+                data = self.__get_disk(file_id)
+                if data is None:
+                    data = fetch()
+                    self.__put_disk(file_id, data)
+                self.__put_memory(file_id, data)
+
+        with self.__lock:
+            self.__key_locks.pop(file_id, None)
+        return data
+
+    def __put_memory(self, file_id: str, data: bytes) -> None:
+        with self.__lock:
+            self.__memory[file_id] = data
+            self.__memory_size += len(data)
+            while self.__memory_size > self.__max_memory and len(self.__memory) > 1:
+                _, old = self.__memory.popitem(last=False)
+                self.__memory_size -= len(old)
+
+    def __get_disk(self, file_id: str) -> bytes | None:
+        if self.__path is None:
+            return None
+        try:
+            return self.__path.joinpath(file_id).read_bytes()
+        except OSError:
+            return None
+
+    def __put_disk(self, file_id: str, data: bytes) -> None:
+        if self.__path is None or len(data) == 0:
+            return
+        # Write to a temporary name first so other runs never read part of a file
+        tmp = self.__path.joinpath(f"{file_id}.tmp")
+        try:
+            tmp.write_bytes(data)
+            tmp.replace(self.__path.joinpath(file_id))
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+
+class AudioKeyCache:
+    def __init__(self, path: Path | None = None, ttl: int = 0):
+        """
+        Caches audio keys by track and file ID in memory and optionally on disk.
+        Keys are encrypted on disk with a secret kept next to the cache that
+        only the current user can read.
+        Args:
+            path: Location of the cache database, None to only cache in memory
+            ttl: Seconds before a cached key is requested again, 0 to disable the
+            disk cache
+        """
+        self.__memory: OrderedDict[tuple[bytes, bytes], tuple[bytes, float]] = (
+            OrderedDict()
+        )
+        self.__lock = Lock()
+        self.__ttl = ttl
+        self.__db = None
+        if path is not None and ttl > 0:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.__secret = self.__load_secret(path.with_suffix(".secret"))
+            self.__db = connect(path, check_same_thread=False)
+            with self.__lock, self.__db:
+                self.__db.execute(
+                    "CREATE TABLE IF NOT EXISTS audio_keys ("
+                    "gid BLOB, "
+                    "file_id BLOB, "
+                    "data BLOB, "
+                    "fetched REAL, "
+                    "PRIMARY KEY (gid, file_id))"
+                )
+                self.__db.execute(
+                    "DELETE FROM audio_keys WHERE fetched < ?", (time() - ttl,)
+                )
+
+    def get(self, gid: bytes, file_id: bytes) -> bytes | None:
+        """
+        Gets a cached audio key
+        Args:
+            gid: ID of the track or episode
+            file_id: ID of the audio file
+        Returns:
+            AES key of the audio file, None if it isn't cached or has expired
+        """
+        cache_key = (gid, file_id)
+        with self.__lock:
+            entry = self.__memory.get(cache_key)
+            if entry is not None and not self.__expired(entry[1]):
+                self.__memory.move_to_end(cache_key)
+                return entry[0]
+
+        if self.__db is None:
+            return None
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT data, fetched FROM audio_keys WHERE gid = ? AND file_id = ?",
+                cache_key,
+            ).fetchone()
+        if row is None or self.__expired(row[1]):
+            return None
+        try:
+            key = self.__decrypt(row[0])
+        except ValueError:
+            return None  # Secret changed or the entry is damaged
+        self.__put_memory(cache_key, key, row[1])
+        return key
+
+    def put(self, gid: bytes, file_id: bytes, key: bytes) -> None:
+        """
+        Adds an audio key to the cache
+        Args:
+            gid: ID of the track or episode
+            file_id: ID of the audio file
+            key: AES key of the audio file
+        """
+        now = time()
+        self.__put_memory((gid, file_id), key, now)
+        if self.__db is None:
+            return
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO audio_keys VALUES (?, ?, ?, ?)",
+                (gid, file_id, self.__encrypt(key), now),
+            )
+
+    def __put_memory(
+        self, cache_key: tuple[bytes, bytes], key: bytes, fetched: float
+    ) -> None:
+        with self.__lock:
+            self.__memory[cache_key] = (key, fetched)
+            self.__memory.move_to_end(cache_key)
+            while len(self.__memory) > MEMORY_CACHE_ENTRIES:
+                self.__memory.popitem(last=False)
+
+    def __expired(self, fetched: float) -> bool:
+        return self.__ttl > 0 and fetched < time() - self.__ttl
+
+    def __encrypt(self, key: bytes) -> bytes:
+        cipher = AES.new(self.__secret, AES.MODE_GCM)
+        data, tag = cipher.encrypt_and_digest(key)
+        return cipher.nonce + tag + data
+
+    def __decrypt(self, data: bytes) -> bytes:
+        cipher = AES.new(self.__secret, AES.MODE_GCM, nonce=data[:16])
+        return cipher.decrypt_and_verify(data[32:], data[16:32])
+
+    @staticmethod
+    def __load_secret(path: Path) -> bytes:
+        try:
+            secret = path.read_bytes()
+            if len(secret) == 32:
+                return secret
+        except OSError:
+            pass
+        secret = get_random_bytes(32)
+        # Only the current user can read the secret
+        path.touch(mode=0o600)
+        path.chmod(0o600)
+        path.write_bytes(secret)
+        return secret
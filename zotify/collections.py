@@ -1,5 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from glob import iglob
+from typing import Iterator, NamedTuple
 
 from librespot.metadata import (
     AlbumId,
@@ -7,10 +9,12 @@ from librespot.metadata import (
     PlaylistId,
     ShowId,
 )
+from librespot.proto import Metadata_pb2 as Metadata
 
 from zotify import ApiClient, API_MAX_REQUEST_LIMIT
 from zotify.config import Config
 from zotify.file import LocalFile
+from zotify.library import LibraryIndex, LibraryScan
 from zotify.utils import (
     MetadataEntry,
     PlayableData,
@@ -19,13 +23,65 @@ from zotify.utils import (
     fix_filename,
 )
 
+# Albums fetched at once when listing an artist's discography
+ARTIST_ALBUM_WORKERS = 8
+
+
+class CollectionError(NamedTuple):
+    type: str
+    id: str
+    message: str
+
 
 class Collection:
-    def __init__(self, api: ApiClient):
+    def __init__(self, b62_id: str, api: ApiClient):
+        self.id = b62_id
         self.playables: list[PlayableData] = []
+        self.errors: list[CollectionError] = []
         self.path: Path = None
         self.api = api
         self.offset = 0
+        self.resolved = False
+
+    def stream(self) -> Iterator[list[PlayableData]]:
+        """
+        Resolves the collection, yielding playables in batches as soon as they
+        are known so downloads can start before large collections are resolved.
+        Resolved playables are also added to playables and failures to errors.
+        Returns:
+            Batches of playables in collection order
+        """
+        if self.resolved:
+            if len(self.playables) > 0:
+                yield list(self.playables)
+            return
+        # Start over if an earlier call stopped part way
+        self.playables = []
+        self.errors = []
+        try:
+            for batch in self._resolve():
+                if len(batch) > 0:
+                    self.playables.extend(batch)
+                    yield batch
+        except Exception as e:
+            # Keep what was resolved, the rest of the collection is skipped
+            self.errors.append(
+                CollectionError(type(self).__name__.lower(), self.id, str(e))
+            )
+        self.resolved = True
+
+    def resolve_all(self) -> list[PlayableData]:
+        """
+        Resolves the whole collection
+        Returns:
+            All playables in the collection
+        """
+        for _ in self.stream():
+            pass
+        return self.playables
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        raise NotImplementedError()
 
     def set_path(self):
         if len(self.playables) == 0:
@@ -47,71 +103,66 @@ class Collection:
         else:
             self.path = library.joinpath(output).expanduser().parent
 
-    def get_existing(self, ext: str) -> dict[str, str]:
+    def get_existing(
+        self,
+        ext: str,
+        library: LibraryIndex | LibraryScan,
+        playables: list[PlayableData] | None = None,
+    ) -> dict[str, str]:
         existing: dict[str, str] = {}
+        if playables is None:
+            playables = self.playables
 
         if self.path is None:
             self.set_path()
         if self.path.exists():
-            if type(self) is Track or type(self) is Episode:
-                file_path = "**/*.{}".format(ext)
-            else:
-                file_path = "*.{}".format(ext)
-            scan_path = str(self.path.joinpath(file_path))
-
-            # Check contents of path
-            for file in iglob(scan_path, recursive=True):
-                f_path = Path(file)
-                f = LocalFile(f_path)
-                try:
-                    existing[f.get_metadata("spotid")] = f_path.stem
-                except IndexError:
-                    pass
-
-            for playable in self.playables:
+            recursive = type(self) is Track or type(self) is Episode
+            path = self.path.resolve()
+            found = library.find(playable.id for playable in playables)
+            for spotid, files in found.items():
+                for f_path in files:
+                    if f_path.suffix != f".{ext}":
+                        continue
+                    if f_path.parent == path or (
+                        recursive and f_path.is_relative_to(path)
+                    ):
+                        existing[spotid] = f_path.stem
+
+            for playable in playables:
                 if playable.id in existing.keys():
                     playable.existing = True
 
         return existing
 
     def get_duplicates(
-        self, ext: str, album_lib: Path, playlist_lib: Path, podcast_lib: Path
+        self,
+        ext: str,
+        album_lib: Path,
+        playlist_lib: Path,
+        podcast_lib: Path,
+        library: LibraryIndex | LibraryScan,
+        playables: list[PlayableData] | None = None,
     ) -> dict[str, str]:
-        existing: dict[str, str] = {}
         duplicates: dict[str, str] = {}
-        scan_paths = []
+        if playables is None:
+            playables = self.playables
 
         if self.path is None:
             self.set_path()
-        if self.path.exists():
-            file_path = "*.{}".format(ext)
-            collection_path = str(self.path.joinpath(file_path))
-
-        file_path = "**/*.{}".format(ext)
-        # Scan album library path
-        scan_paths.append(str(album_lib.joinpath(file_path)))
-        # Scan playlist library path
-        scan_paths.append(str(playlist_lib.joinpath(file_path)))
-        # Scan podcast library path
-        scan_paths.append(str(podcast_lib.joinpath(file_path)))
-
-        for scan_path in scan_paths:
-            for file in iglob(scan_path, recursive=True):
-                f_path = Path(file)
-                if self.path.exists() and f_path.match(collection_path):
+        path = self.path.resolve()
+        libraries = [lib.resolve() for lib in (album_lib, playlist_lib, podcast_lib)]
+        found = library.find(playable.id for playable in playables)
+        for spotid, files in found.items():
+            for f_path in files:
+                # Files in the collection's own folder are existing, not duplicates
+                if f_path.suffix != f".{ext}" or f_path.parent == path:
                     continue
-                f = LocalFile(f_path)
-                try:
-                    existing[f.get_metadata("spotid")] = f_path.stem
-                except IndexError:
-                    pass
+                if any(f_path.is_relative_to(lib) for lib in libraries):
+                    duplicates[spotid] = f_path.stem
 
-            for playable in self.playables:
-                if playable.id in existing.keys():
-                    playable.duplicate = True
-                    duplicates[playable.id] = existing[playable.id]
-
-            existing = {}
+        for playable in playables:
+            if playable.id in duplicates.keys():
+                playable.duplicate = True
 
         return duplicates
 
@@ -192,35 +243,24 @@ class Collection:
 
 class Album(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        album = api.get_metadata_4_album(AlbumId.from_base62(b62_id))
-        self.name = album.name
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
 
-        total_discs = len(album.disc)
-        for disc in album.disc:
-            for track in disc.track:
-                metadata = [
-                    MetadataEntry("spotid", bytes_to_base62(track.gid)),
-                    MetadataEntry("album_artist", album.artist[0].name),
-                    MetadataEntry("album", album.name),
-                    MetadataEntry("discnumber", disc.number),
-                    MetadataEntry("disctotal", total_discs),
-                ]
-                self.playables.append(
-                    PlayableData(
-                        PlayableType.TRACK,
-                        bytes_to_base62(track.gid),
-                        config.album_library,
-                        config.output_album,
-                        metadata,
-                    )
-                )
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        album = self.api.get_metadata_4_album(AlbumId.from_base62(self.id))
+        self.name = album.name
+        yield album_playables(album, self.__config)
 
 
 class Artist(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        artist = api.get_metadata_4_artist(ArtistId.from_base62(b62_id))
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        artist = self.api.get_metadata_4_artist(ArtistId.from_base62(self.id))
         self.name = artist.name
 
         # Only include albums and singles for now. Other groups require filtering.
@@ -234,64 +274,68 @@ class Artist(Collection):
         if artist.appears_on_group:
             pass
 
-        for album_group in all_groups:
+        def get_album(album_id: str) -> Metadata.Album | CollectionError:
             try:
-                album = api.get_metadata_4_album(
-                    AlbumId.from_base62(bytes_to_base62(album_group.album[0].gid))
-                )
-                total_discs = len(album.disc)
-                for disc in album.disc:
-                    for track in disc.track:
-                        metadata = [
-                            MetadataEntry("spotid", bytes_to_base62(track.gid)),
-                            MetadataEntry("album_artist", album.artist[0].name),
-                            MetadataEntry("album", album.name),
-                            MetadataEntry("discnumber", disc.number),
-                            MetadataEntry("disctotal", total_discs),
-                        ]
-                        self.playables.append(
-                            PlayableData(
-                                PlayableType.TRACK,
-                                bytes_to_base62(track.gid),
-                                config.album_library,
-                                config.output_album,
-                                metadata,
-                            )
-                        )
+                return self.api.get_metadata_4_album(AlbumId.from_base62(album_id))
             except Exception as e:
-                # Skip albums that can't be processed
-                print(f"Error processing album: {e}")
-                continue
+                return CollectionError("album", album_id, str(e))
+
+        # Albums are fetched concurrently, map yields them in discography order
+        # as soon as each one and those before it are fetched
+        album_ids = [bytes_to_base62(g.album[0].gid) for g in all_groups]
+        pool = ThreadPoolExecutor(ARTIST_ALBUM_WORKERS)
+        try:
+            for album in pool.map(get_album, album_ids):
+                if isinstance(album, CollectionError):
+                    # Skip albums that can't be processed
+                    self.errors.append(album)
+                    continue
+                yield album_playables(album, self.__config)
+        finally:
+            # If the caller stops early, don't wait for the remaining albums
+            pool.shutdown(wait=False, cancel_futures=True)
 
 
 class Show(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        show = api.get_metadata_4_show(ShowId.from_base62(b62_id))
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        show = self.api.get_metadata_4_show(ShowId.from_base62(self.id))
         self.name = show.name
 
+        playables = []
         for episode in show.episode:
             metadata = [
                 MetadataEntry("spotid", bytes_to_base62(episode.gid)),
                 MetadataEntry("podcast", show.name),
             ]
-            self.playables.append(
+            playables.append(
                 PlayableData(
                     PlayableType.EPISODE,
                     bytes_to_base62(episode.gid),
-                    config.podcast_library,
-                    config.output_podcast,
+                    self.__config.podcast_library,
+                    self.__config.output_podcast,
                     metadata,
                 )
             )
+        yield playables
 
 
 class Playlist(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        playlist = api.get_playlist(PlaylistId(b62_id))
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        config = self.__config
+        playlist = self.api.get_playlist(PlaylistId(self.id))
         self.name = playlist.attributes.name
 
+        playables = []
         for i in range(len(playlist.contents.items)):
             item = playlist.contents.items[i]
             split = item.uri.split(":")
@@ -309,7 +353,7 @@ class Playlist(Collection):
                 ),
             ]
             if playable_type == "track":
-                self.playables.append(
+                playables.append(
                     PlayableData(
                         PlayableType.TRACK,
                         playable_id,
@@ -319,7 +363,7 @@ class Playlist(Collection):
                     )
                 )
             elif playable_type == "episode":
-                self.playables.append(
+                playables.append(
                     PlayableData(
                         PlayableType.EPISODE,
                         playable_id,
@@ -333,33 +377,74 @@ class Playlist(Collection):
                 pass
             else:
                 raise ValueError("Unknown playable content", playable_type)
+        yield playables
 
 
 class Track(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        metadata = [MetadataEntry("spotid", b62_id)]
-        self.playables.append(
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        metadata = [MetadataEntry("spotid", self.id)]
+        yield [
             PlayableData(
                 PlayableType.TRACK,
-                b62_id,
-                config.album_library,
-                config.output_album,
+                self.id,
+                self.__config.album_library,
+                self.__config.output_album,
                 metadata,
             )
-        )
+        ]
 
 
 class Episode(Collection):
     def __init__(self, b62_id: str, api: ApiClient, config: Config = Config()):
-        super().__init__(api)
-        metadata = [MetadataEntry("spotid", b62_id)]
-        self.playables.append(
+        super().__init__(b62_id, api)
+        self.name = b62_id
+        self.__config = config
+
+    def _resolve(self) -> Iterator[list[PlayableData]]:
+        metadata = [MetadataEntry("spotid", self.id)]
+        yield [
             PlayableData(
                 PlayableType.EPISODE,
-                b62_id,
-                config.podcast_library,
-                config.output_podcast,
+                self.id,
+                self.__config.podcast_library,
+                self.__config.output_podcast,
                 metadata,
             )
-        )
+        ]
+
+
+def album_playables(album: Metadata.Album, config: Config) -> list[PlayableData]:
+    """
+    Lists the tracks of an album
+    Args:
+        album: Album metadata
+        config: Config to get the library and output template from
+    Returns:
+        Playables for every track on the album
+    """
+    playables = []
+    total_discs = len(album.disc)
+    for disc in album.disc:
+        for track in disc.track:
+            metadata = [
+                MetadataEntry("spotid", bytes_to_base62(track.gid)),
+                MetadataEntry("album_artist", album.artist[0].name),
+                MetadataEntry("album", album.name),
+                MetadataEntry("discnumber", disc.number),
+                MetadataEntry("disctotal", total_discs),
+            ]
+            playables.append(
+                PlayableData(
+                    PlayableType.TRACK,
+                    bytes_to_base62(track.gid),
+                    config.album_library,
+                    config.output_album,
+                    metadata,
+                )
+            )
+    return playables
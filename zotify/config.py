@@ -11,15 +11,27 @@ ALBUM_LIBRARY = "album_library"
 ALL_ARTISTS = "all_artists"
 ARTWORK_SIZE = "artwork_size"
 AUDIO_FORMAT = "audio_format"
+AUDIO_KEY_CACHE = "audio_key_cache"
+AUDIO_KEY_CACHE_TTL = "audio_key_cache_ttl"
+CACHE_PATH = "cache_path"
+CHUNK_SIZE = "chunk_size"
+COVER_ART_CACHE = "cover_art_cache"
 CREATE_PLAYLIST_FILE = "create_playlist_file"
 CREDENTIALS_PATH = "credentials_path"
 DOWNLOAD_QUALITY = "download_quality"
 DOWNLOAD_REAL_TIME = "download_real_time"
 FFMPEG_ARGS = "ffmpeg_args"
 FFMPEG_PATH = "ffmpeg_path"
+HTTP_POOL_SIZE = "http_pool_size"
+HTTP_TIMEOUT = "http_timeout"
+INDEX_PATH = "index_path"
 LANGUAGE = "language"
+LIBRARY_INDEX = "library_index"
+LOOKAHEAD = "lookahead"
 LYRICS_FILE = "lyrics_file"
 LYRICS_ONLY = "lyrics_only"
+METADATA_CACHE_SIZE = "metadata_cache_size"
+METADATA_CACHE_TTL = "metadata_cache_ttl"
 OUTPUT = "output"
 OUTPUT_ALBUM = "output_album"
 OUTPUT_PLAYLIST_TRACK = "output_playlist_track"
@@ -32,14 +44,23 @@ PRINT_DOWNLOADS = "print_downloads"
 PRINT_ERRORS = "print_errors"
 PRINT_PROGRESS = "print_progress"
 PRINT_SKIPS = "print_skips"
+PRINT_SUMMARY = "print_summary"
 PRINT_WARNINGS = "print_warnings"
+QUEUE_SIZE = "queue_size"
+RATE_LIMIT_MAX = "rate_limit_max"
+RATE_LIMIT_MIN = "rate_limit_min"
 REPLACE_EXISTING = "replace_existing"
 SAVE_GENRE = "save_genre"
 SAVE_METADATA = "save_metadata"
 SAVE_SUBTITLES = "save_subtitles"
+SCAN_WORKERS = "scan_workers"
 SKIP_DUPLICATES = "skip_duplicates"
 SKIP_PREVIOUS = "skip_previous"
+STREAM_TRANSCODE = "stream_transcode"
+TAG_WORKERS = "tag_workers"
 TRANSCODE_BITRATE = "transcode_bitrate"
+TRANSCODE_WORKERS = "transcode_workers"
+WORKERS = "workers"
 
 SYSTEM_PATHS = {
     "win32": Path.home().joinpath("AppData/Roaming/Zotify"),
@@ -58,6 +79,8 @@ LIBRARY_PATHS = {
 CONFIG_PATHS = {
     "conf": SYSTEM_PATHS[PLATFORM].joinpath("config.json"),
     "creds": SYSTEM_PATHS[PLATFORM].joinpath("credentials.json"),
+    "index": SYSTEM_PATHS[PLATFORM].joinpath("library.db"),
+    "cache": SYSTEM_PATHS[PLATFORM].joinpath("cache"),
 }
 
 OUTPUT_PATHS = {
@@ -74,6 +97,18 @@ CONFIG_VALUES = {
         "args": ["--credentials"],
         "help": "Path to credentials file",
     },
+    INDEX_PATH: {
+        "default": CONFIG_PATHS["index"],
+        "type": Path,
+        "args": ["--index"],
+        "help": "Path to library index file",
+    },
+    CACHE_PATH: {
+        "default": CONFIG_PATHS["cache"],
+        "type": Path,
+        "args": ["--cache"],
+        "help": "Path to cache folder",
+    },
     ALBUM_LIBRARY: {
         "default": LIBRARY_PATHS["album"],
         "type": Path,
@@ -129,6 +164,66 @@ CONFIG_VALUES = {
         "args": ["--download-real-time"],
         "help": "Download at the same rate as the track being played",
     },
+    CHUNK_SIZE: {
+        "default": 65536,
+        "type": int,
+        "args": ["--chunk-size"],
+        "help": "Size of reads from the audio stream in bytes (1024 to 65536)",
+    },
+    WORKERS: {
+        "default": 1,
+        "type": int,
+        "args": ["--workers"],
+        "help": "Number of tracks to download concurrently",
+    },
+    TRANSCODE_WORKERS: {
+        "default": 0,
+        "type": int,
+        "args": ["--transcode-workers"],
+        "help": "Number of tracks to transcode concurrently (0 to use CPU count)",
+    },
+    TAG_WORKERS: {
+        "default": 1,
+        "type": int,
+        "args": ["--tag-workers"],
+        "help": "Number of tracks to write metadata to concurrently",
+    },
+    QUEUE_SIZE: {
+        "default": 2,
+        "type": int,
+        "args": ["--queue-size"],
+        "help": "Maximum number of tracks waiting between download steps",
+    },
+    LOOKAHEAD: {
+        "default": 4,
+        "type": int,
+        "args": ["--lookahead"],
+        "help": "Number of upcoming tracks to request audio keys and stream locations for ahead of time (0 to disable)",
+    },
+    HTTP_TIMEOUT: {
+        "default": 30,
+        "type": int,
+        "args": ["--http-timeout"],
+        "help": "Seconds to wait for a server to connect or send data",
+    },
+    HTTP_POOL_SIZE: {
+        "default": 10,
+        "type": int,
+        "args": ["--http-pool-size"],
+        "help": "Maximum number of open connections to each server",
+    },
+    RATE_LIMIT_MIN: {
+        "default": 3,
+        "type": int,
+        "args": ["--rate-limit-min"],
+        "help": "Lowest number of audio key requests per 30 seconds when the server is throttling, other requests scale with it",
+    },
+    RATE_LIMIT_MAX: {
+        "default": 18,
+        "type": int,
+        "args": ["--rate-limit-max"],
+        "help": "Highest number of audio key requests per 30 seconds, other requests scale with it",
+    },
     ARTWORK_SIZE: {
         "default": "large",
         "type": ImageSize.from_string,
@@ -136,6 +231,12 @@ CONFIG_VALUES = {
         "args": ["--artwork-size"],
         "help": "Image size of track's cover art",
     },
+    COVER_ART_CACHE: {
+        "default": True,
+        "type": bool,
+        "args": ["--cover-art-cache"],
+        "help": "Keep downloaded cover art in the cache folder for later runs",
+    },
     AUDIO_FORMAT: {
         "default": "vorbis",
         "type": AudioFormat.from_string,
@@ -161,6 +262,36 @@ CONFIG_VALUES = {
         "args": ["--ffmpeg-args"],
         "help": "Additional ffmpeg arguments when transcoding",
     },
+    STREAM_TRANSCODE: {
+        "default": False,
+        "type": bool,
+        "args": ["--stream-transcode"],
+        "help": "Transcode while downloading instead of from a temporary file",
+    },
+    METADATA_CACHE_TTL: {
+        "default": 168,
+        "type": int,
+        "args": ["--metadata-cache-ttl"],
+        "help": "Hours to keep album metadata cached on disk (0 to disable)",
+    },
+    METADATA_CACHE_SIZE: {
+        "default": 64,
+        "type": int,
+        "args": ["--metadata-cache-size"],
+        "help": "Maximum size of the metadata cache in MiB",
+    },
+    AUDIO_KEY_CACHE: {
+        "default": False,
+        "type": bool,
+        "args": ["--audio-key-cache"],
+        "help": "Keep audio keys encrypted in the cache folder for later runs",
+    },
+    AUDIO_KEY_CACHE_TTL: {
+        "default": 720,
+        "type": int,
+        "args": ["--audio-key-cache-ttl"],
+        "help": "Hours to keep audio keys cached",
+    },
     SAVE_SUBTITLES: {
         "default": False,
         "type": bool,
@@ -227,6 +358,18 @@ CONFIG_VALUES = {
         "args": ["--skip-duplicates"],
         "help": "Skip downloading existing track to different album",
     },
+    LIBRARY_INDEX: {
+        "default": True,
+        "type": bool,
+        "args": ["--library-index"],
+        "help": "Use an index of downloaded files to find existing tracks",
+    },
+    SCAN_WORKERS: {
+        "default": 8,
+        "type": int,
+        "args": ["--scan-workers"],
+        "help": "Number of files to read tags from concurrently when scanning the library",
+    },
     PRINT_DOWNLOADS: {
         "default": False,
         "type": bool,
@@ -245,6 +388,12 @@ CONFIG_VALUES = {
         "args": ["--print-skips"],
         "help": "Show messages if a song is being skipped",
     },
+    PRINT_SUMMARY: {
+        "default": True,
+        "type": bool,
+        "args": ["--print-summary"],
+        "help": "Show a summary of requests and rate limiting after downloading",
+    },
     PRINT_WARNINGS: {
         "default": True,
         "type": bool,
@@ -265,13 +414,25 @@ class Config:
     album_library: Path
     artwork_size: ImageSize
     audio_format: AudioFormat
+    audio_key_cache: bool
+    audio_key_cache_ttl: int
+    cache_path: Path
+    chunk_size: int
+    cover_art_cache: bool
     credentials_path: Path
     download_quality: Quality
     download_real_time: bool
     ffmpeg_args: str
     ffmpeg_path: str
+    http_pool_size: int
+    http_timeout: int
+    index_path: Path
     language: str
+    library_index: bool
+    lookahead: int
     lyrics_file: bool
+    metadata_cache_size: int
+    metadata_cache_ttl: int
     output_album: str
     output_podcast: str
     output_playlist_track: str
@@ -279,9 +440,17 @@ class Config:
     playlist_library: Path
     podcast_library: Path
     print_progress: bool
+    queue_size: int
+    rate_limit_max: int
+    rate_limit_min: int
     replace_existing: bool
     save_metadata: bool
+    scan_workers: int
+    stream_transcode: bool
+    tag_workers: int
     transcode_bitrate: int
+    transcode_workers: int
+    workers: int
 
     def __init__(self, args: Namespace | None = None):
         jsonvalues = {}
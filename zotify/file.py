@@ -1,6 +1,8 @@
 from errno import ENOENT
 from pathlib import Path
 from subprocess import PIPE, Popen
+from tempfile import TemporaryFile
+from threading import Lock
 
 from music_tag import load_file
 from mutagen.oggvorbis import OggVorbisHeaderError
@@ -11,6 +13,54 @@ from zotify.utils import AudioFormat, MetadataEntry, Quality
 class TranscodingError(RuntimeError): ...
 
 
+def ffmpeg_command(
+    source: str,
+    target: Path,
+    audio_format: AudioFormat | None,
+    download_quality: Quality | None = None,
+    bitrate: int = -1,
+    ffmpeg: str = "",
+    opt_args: list[str] = [],
+) -> list[str]:
+    """
+    Builds an ffmpeg command line
+    Args:
+        source: Input file, or pipe:0 to read from stdin
+        target: Output file
+        audio_format: Audio format to transcode to
+        download_quality: Quality used to pick the bitrate if none is given
+        bitrate: Bitrate to transcode file to in kbps
+        ffmpeg: Location of FFmpeg binary
+        opt_args: Additional arguments to pass to ffmpeg
+    Returns:
+        Command as a list of arguments
+    """
+    cmd = [
+        ffmpeg if ffmpeg != "" else "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        source,
+    ]
+    if bitrate > 0:
+        cmd.extend(["-b:a", str(bitrate) + "k"])
+    else:
+        cmd.extend(["-b:a", str(Quality.get_bitrate(download_quality)) + "k"])
+    cmd.extend(["-c:a", audio_format.value.name]) if audio_format else None
+    cmd.extend(opt_args)
+    cmd.append(str(target))
+    return cmd
+
+
+def ffmpeg_error(cmd: list[str], returncode: int, stderr: bytes | None) -> str:
+    message = f'`{" ".join(cmd)}` failed with error code {returncode}'
+    if stderr:
+        message += f": {stderr.decode(errors='replace').strip()}"
+    return message
+
+
 class LocalFile:
     def __init__(
         self,
@@ -47,15 +97,6 @@ class LocalFile:
         else:
             ext = self.__path.suffix[1:]
 
-        cmd = [
-            ffmpeg if ffmpeg != "" else "ffmpeg",
-            "-y",
-            "-hide_banner",
-            "-loglevel",
-            "error",
-            "-i",
-            str(self.__path),
-        ]
         path = self.__path.parent.joinpath(
             self.__path.name.rsplit(".", 1)[0] + "." + ext
         )
@@ -63,27 +104,28 @@ class LocalFile:
             raise TranscodingError(
                 f"Cannot overwrite source, target file {path} already exists."
             )
-
-        if bitrate > 0:
-            cmd.extend(["-b:a", str(bitrate) + "k"])
-        else:
-            cmd.extend(["-b:a", str(Quality.get_bitrate(download_quality)) + "k"])
-        cmd.extend(["-c:a", audio_format.value.name]) if audio_format else None
-        cmd.extend(opt_args)
-        cmd.append(str(path))
+        cmd = ffmpeg_command(
+            str(self.__path),
+            path,
+            audio_format,
+            download_quality,
+            bitrate,
+            ffmpeg,
+            opt_args,
+        )
 
         try:
-            process = Popen(cmd, stdin=PIPE)
-            process.wait()
+            # Errors are collected instead of printed so output from
+            # several transcodes running at once doesn't interleave
+            process = Popen(cmd, stdin=PIPE, stderr=PIPE)
+            _, stderr = process.communicate()
         except OSError as e:
             if e.errno == ENOENT:
                 raise TranscodingError("FFmpeg was not found")
             else:
                 raise
         if process.returncode != 0:
-            raise TranscodingError(
-                f'`{" ".join(cmd)}` failed with error code {process.returncode}'
-            )
+            raise TranscodingError(ffmpeg_error(cmd, process.returncode, stderr))
 
         if replace:
             self.__path.unlink()
@@ -139,4 +181,131 @@ class LocalFile:
         """
         path = self.__path
         clean = path.name.replace("_tmp", "")
-        path.rename(path.parent.joinpath(clean))
+        self.__path = path.rename(path.parent.joinpath(clean))
+
+    def path(self) -> Path:
+        """
+        Returns:
+            Current location of the file
+        """
+        return self.__path
+
+
+class PlaylistFile:
+    def __init__(self, path: Path):
+        """
+        Creates an m3u8 playlist file. Entries added out of order are held back
+        until all preceding entries are known so the playlist keeps the order of
+        the collection when tracks finish downloading concurrently.
+        Args:
+            path: Location of the playlist file
+        """
+        self.__path = path
+        self.__entries: dict[int, str | None] = {}
+        self.__next = 0
+        self.__lock = Lock()
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.__path, "w", encoding="utf-8") as f:
+            f.write("#EXTM3U\n")
+
+    def add(self, index: int, duration: int | None = None, path: str = "") -> None:
+        """
+        Adds an entry to the playlist
+        Args:
+            index: Position of the entry in the collection, starting from 0
+            duration: Duration of the entry, None if nothing was downloaded
+            path: Path of the downloaded file
+        """
+        with self.__lock:
+            self.__entries[index] = (
+                None if duration is None else f"#EXTINF:{duration},\n{path}\n"
+            )
+            with open(self.__path, "a", encoding="utf-8") as f:
+                while self.__next in self.__entries:
+                    entry = self.__entries.pop(self.__next)
+                    if entry is not None:
+                        f.write(entry)
+                    self.__next += 1
+
+
+class TranscodeStream:
+    def __init__(
+        self,
+        path: Path,
+        audio_format: AudioFormat,
+        download_quality: Quality | None = None,
+        bitrate: int = -1,
+        ffmpeg: str = "",
+        opt_args: list[str] = [],
+    ):
+        """
+        Writable stream that transcodes everything written to it with ffmpeg,
+        avoiding a temporary file for the source audio
+        Args:
+            path: Output file
+            audio_format: Audio format to transcode to
+            download_quality: Quality used to pick the bitrate if none is given
+            bitrate: Bitrate to transcode file to in kbps
+            ffmpeg: Location of FFmpeg binary
+            opt_args: Additional arguments to pass to ffmpeg
+        """
+        self.__path = path
+        self.__audio_format = audio_format
+        self.__bitrate = bitrate
+        self.__cmd = ffmpeg_command(
+            "pipe:0", path, audio_format, download_quality, bitrate, ffmpeg, opt_args
+        )
+        # A file can't fill up and block ffmpeg the way an unread pipe can
+        self.__stderr = TemporaryFile()
+        try:
+            self.__process = Popen(self.__cmd, stdin=PIPE, stderr=self.__stderr)
+        except OSError as e:
+            self.__stderr.close()
+            if e.errno == ENOENT:
+                raise TranscodingError("FFmpeg was not found")
+            else:
+                raise
+
+    def write(self, data: bytes | memoryview) -> int:
+        """
+        Passes audio data to ffmpeg
+        Args:
+            data: Audio data
+        Returns:
+            Number of bytes written
+        """
+        try:
+            return self.__process.stdin.write(data)
+        except BrokenPipeError:
+            self.close()
+            raise TranscodingError(f'`{" ".join(self.__cmd)}` stopped reading input')
+
+    def close(self) -> LocalFile:
+        """
+        Waits for ffmpeg to finish
+        Returns:
+            LocalFile object of the transcoded file
+        """
+        if not self.__stderr.closed:
+            try:
+                self.__process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.__process.wait()
+            self.__stderr.seek(0)
+            stderr = self.__stderr.read()
+            self.__stderr.close()
+            if self.__process.returncode != 0:
+                self.__path.unlink(missing_ok=True)
+                raise TranscodingError(
+                    ffmpeg_error(self.__cmd, self.__process.returncode, stderr)
+                )
+        return LocalFile(self.__path, self.__audio_format, self.__bitrate)
+
+    def kill(self) -> None:
+        """Stops ffmpeg and removes the partial output"""
+        if not self.__stderr.closed:
+            self.__process.kill()
+            self.__process.wait()
+            self.__stderr.close()
+            self.__path.unlink(missing_ok=True)
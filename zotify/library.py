@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from os import scandir
+from pathlib import Path
+from sqlite3 import connect
+from threading import Lock
+from typing import Callable, Iterable, Iterator
+
+from zotify.file import LocalFile
+from zotify.logger import Logger
+from zotify.tags import probe_tags
+from zotify.utils import AudioFormat
+
+# SQLite limits the number of parameters in a single query
+QUERY_BATCH_SIZE = 500
+
+
+def unique_roots(roots: list[Path]) -> list[Path]:
+    """
+    Removes directories contained in another one so files are only visited once
+    Args:
+        roots: Library directories
+    Returns:
+        Resolved directories that don't overlap
+    """
+    roots = sorted(set(r.resolve() for r in roots))
+    unique: list[Path] = []
+    for root in roots:
+        if not any(root.is_relative_to(u) for u in unique):
+            unique.append(root)
+    return unique
+
+
+def audio_files(roots: list[Path], workers: int = 1) -> Iterator[Path]:
+    """
+    Finds every file with the extension of a supported audio format. Directories
+    are listed concurrently, which helps most on network filesystems.
+    Args:
+        roots: Directories to search recursively
+        workers: Number of directories listed at once
+    Returns:
+        Paths of audio files
+    """
+    exts = {f.value.ext for f in AudioFormat}
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        pending = {pool.submit(_list_dir, root) for root in unique_roots(roots)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                pending.update(pool.submit(_list_dir, d) for d in dirs)
+                yield from (f for f in files if f.suffix[1:] in exts)
+
+
+def _list_dir(path: Path) -> tuple[list[Path], list[Path]]:
+    files: list[Path] = []
+    dirs: list[Path] = []
+    try:
+        with scandir(path) as entries:
+            for entry in entries:
+                # Like os.walk, don't follow symlinks to directories
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(Path(entry.path))
+                else:
+                    files.append(Path(entry.path))
+    except OSError:
+        pass
+    return files, dirs
+
+
+def scan_tags(
+    paths: Iterable[Path],
+    workers: int = 1,
+    changed: Callable[[Path], bool] | None = None,
+) -> Iterator[tuple[Path, tuple[str | None, str | None] | None]]:
+    """
+    Reads tags from files concurrently, showing the number of files per second
+    Args:
+        paths: Audio files to read
+        workers: Number of files read at once
+        changed: Tags are only read from files this returns True for
+    Returns:
+        Each path with its track ID and ISRC, or None if the file is unchanged.
+        Results are in the order reads finish.
+    """
+
+    def read(path: Path) -> tuple[Path, tuple[str | None, str | None] | None]:
+        try:
+            if changed is not None and not changed(path):
+                return path, None
+        except OSError:
+            return path, None
+        return path, read_tags(path)
+
+    with Logger.progress(
+        desc="Scanning library",
+        unit=" files",
+        unit_scale=False,
+    ) as p_bar:
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            futures = [pool.submit(read, path) for path in paths]
+            for future in as_completed(futures):
+                p_bar.update()
+                yield future.result()
+
+
+def read_tags(path: Path) -> tuple[str | None, str | None]:
+    """
+    Reads the tags stored in the index from a file
+    Args:
+        path: Location of the file
+    Returns:
+        Track ID and ISRC, None where missing
+    """
+    probed = probe_tags(path, ("spotid", "isrc"))
+    if probed is not None:
+        # Files parsed without an ID weren't downloaded by zotify
+        return probed.get("spotid"), probed.get("isrc")
+
+    # Formats the probe can't read
+    f = LocalFile(path)
+    tags = []
+    for tag in ("spotid", "isrc"):
+        try:
+            tags.append(f.get_metadata(tag) or None)
+        except Exception:
+            # Missing tags raise IndexError, unreadable files anything
+            tags.append(None)
+    return tags[0], tags[1]
+
+
+class LibraryScan:
+    def __init__(self, roots: list[Path], workers: int = 1):
+        """
+        Reads the ID of every audio file under the given directories once, so
+        all collections in a run can be checked without scanning again. Used
+        when the library index is disabled.
+        Args:
+            roots: Library directories to scan
+            workers: Number of files read at once
+        """
+        self.__files: dict[str, list[Path]] = {}
+        for path, tags in scan_tags(audio_files(roots, workers), workers):
+            if tags is not None and tags[0] is not None:
+                self.__files.setdefault(tags[0], []).append(path)
+
+    def find(self, spotids: Iterable[str]) -> dict[str, list[Path]]:
+        """
+        Looks up files by ID
+        Args:
+            spotids: Base62 IDs of tracks or episodes
+        Returns:
+            Dictionary of IDs to the files saved with that ID
+        """
+        return {
+            spotid: self.__files[spotid]
+            for spotid in set(spotids)
+            if spotid in self.__files
+        }
+
+
+class LibraryIndex:
+    def __init__(self, path: Path):
+        """
+        Persistent index of downloaded files, avoids reading tags from every file
+        in the library to find previously downloaded tracks
+        Args:
+            path: Location of the index database
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = Lock()
+        self.__db = connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "spotid TEXT, "
+                "size INTEGER, "
+                "mtime REAL, "
+                "format TEXT, "
+                "isrc TEXT)"
+            )
+            self.__db.execute(
+                "CREATE INDEX IF NOT EXISTS files_spotid ON files (spotid)"
+            )
+            # Directories that have been scanned in full
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY)"
+            )
+
+    def unindexed(self, roots: list[Path]) -> list[Path]:
+        """
+        Finds library directories that haven't been scanned into the index yet
+        Args:
+            roots: Library directories
+        Returns:
+            Resolved directories that need to be scanned
+        """
+        with self.__lock:
+            indexed = [Path(r) for (r,) in self.__db.execute("SELECT path FROM roots")]
+        return [
+            root
+            for root in unique_roots(roots)
+            if not any(root.is_relative_to(i) for i in indexed)
+        ]
+
+    def add(self, path: Path, spotid: str | None, isrc: str | None = None) -> None:
+        """
+        Adds or updates a file in the index
+        Args:
+            path: Location of the file
+            spotid: Base62 ID of the track or episode saved in the file
+            isrc: ISRC of the track if known
+        """
+        path = path.resolve()
+        stat = path.stat()
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    spotid,
+                    stat.st_size,
+                    stat.st_mtime,
+                    path.suffix[1:],
+                    isrc,
+                ),
+            )
+
+    def remove(self, path: Path) -> None:
+        """
+        Removes a file from the index
+        Args:
+            path: Location of the file
+        """
+        with self.__lock, self.__db:
+            self.__db.execute("DELETE FROM files WHERE path = ?", (str(path),))
+
+    def find(self, spotids: Iterable[str]) -> dict[str, list[Path]]:
+        """
+        Looks up files by ID. Files that no longer exist are removed from the index.
+        Args:
+            spotids: Base62 IDs of tracks or episodes
+        Returns:
+            Dictionary of IDs to the files saved with that ID
+        """
+        spotids = list(set(spotids))
+        rows = []
+        with self.__lock:
+            for i in range(0, len(spotids), QUERY_BATCH_SIZE):
+                batch = spotids[i : i + QUERY_BATCH_SIZE]
+                rows.extend(
+                    self.__db.execute(
+                        "SELECT spotid, path FROM files WHERE spotid IN ({})".format(
+                            ",".join("?" * len(batch))
+                        ),
+                        batch,
+                    ).fetchall()
+                )
+
+        found: dict[str, list[Path]] = {}
+        for spotid, path in rows:
+            path = Path(path)
+            if path.exists():
+                found.setdefault(spotid, []).append(path)
+            else:
+                self.remove(path)
+        return found
+
+    def rebuild(self, roots: list[Path], workers: int = 1) -> int:
+        """
+        Indexes every audio file under the given directories. Tags are only read
+        from files that are new or changed since they were last indexed.
+        Args:
+            roots: Library directories to scan
+            workers: Number of files read at once
+        Returns:
+            Number of indexed files
+        """
+        with self.__lock:
+            known = {
+                path: (size, mtime)
+                for path, size, mtime in self.__db.execute(
+                    "SELECT path, size, mtime FROM files"
+                )
+            }
+
+        def changed(path: Path) -> bool:
+            stat = path.stat()
+            return known.get(str(path)) != (stat.st_size, stat.st_mtime)
+
+        roots = unique_roots(roots)
+        seen: set[str] = set()
+        files = audio_files(roots, workers)
+        for path, tags in scan_tags(files, workers, changed):
+            seen.add(str(path))
+            if tags is not None:
+                try:
+                    self.add(path, *tags)
+                except OSError:
+                    pass  # Removed while scanning
+
+        with self.__lock, self.__db:
+            for path in known.keys() - seen:
+                if any(Path(path).is_relative_to(r) for r in roots):
+                    self.__db.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO roots VALUES (?)",
+                [(str(root),) for root in roots],
+            )
+        return len(seen)
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__db.close()
@@ -1,5 +1,5 @@
 from enum import Enum
-from sys import stderr
+from sys import stderr, stdout
 
 from tqdm import tqdm
 
@@ -8,6 +8,7 @@ from zotify.config import (
     PRINT_ERRORS,
     PRINT_PROGRESS,
     PRINT_SKIPS,
+    PRINT_SUMMARY,
     PRINT_WARNINGS,
     Config,
 )
@@ -19,6 +20,7 @@ class LogChannel(Enum):
     ERRORS = PRINT_ERRORS
     WARNINGS = PRINT_WARNINGS
     DOWNLOADS = PRINT_DOWNLOADS
+    SUMMARY = PRINT_SUMMARY
 
 
 class Logger:
@@ -31,16 +33,17 @@ class Logger:
     @classmethod
     def log(cls, channel: LogChannel, msg: str) -> None:
         """
-        Prints a message to console if the print channel is enabled
+        Prints a message to console if the print channel is enabled.
+        Safe to call from multiple threads while progress bars are shown.
         Args:
             channel: LogChannel to print to
             msg: Message to log
         """
         if cls.__config.get(channel.value):
             if channel == LogChannel.ERRORS:
-                print(msg, file=stderr)
+                tqdm.write(msg, file=stderr)
             else:
-                print(msg)
+                tqdm.write(msg, file=stdout)
 
     @classmethod
     def progress(
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Any
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from zotify.config import HTTP_POOL_SIZE, HTTP_TIMEOUT, Config
+
+
+class Http:
+    """
+    Shared HTTP session. Connections are kept alive and pooled per host so API
+    requests, cover art and tokens don't need a new TCP and TLS handshake each
+    time. Safe to use from multiple threads.
+    """
+
+    __config: Config = Config()
+    __session: Session | None = None
+    __lock = Lock()
+    requests: int = 0
+    connections: int = 0
+
+    @classmethod
+    def __init__(cls, config: Config):
+        with cls.__lock:
+            cls.__config = config
+            if cls.__session is not None:
+                cls.__session.close()
+            cls.__session = None
+
+    @classmethod
+    def session(cls) -> Session:
+        """
+        Returns:
+            Session shared by all requests
+        """
+        with cls.__lock:
+            if cls.__session is None:
+                cls.__session = Session()
+                adapter = Http.Adapter(
+                    cls.__config.get(HTTP_TIMEOUT),
+                    pool_maxsize=cls.__config.get(HTTP_POOL_SIZE),
+                )
+                cls.__session.mount("https://", adapter)
+                cls.__session.mount("http://", adapter)
+            return cls.__session
+
+    @classmethod
+    def get(cls, url: str, **kwargs: Any) -> Response:
+        """
+        Sends a GET request
+        Args:
+            url: URL to request
+            kwargs: Arguments passed to requests
+        Returns:
+            Response
+        """
+        return cls.session().get(url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs: Any) -> Response:
+        """
+        Sends a POST request
+        Args:
+            url: URL to request
+            kwargs: Arguments passed to requests
+        Returns:
+            Response
+        """
+        return cls.session().post(url, **kwargs)
+
+    @classmethod
+    def count(cls, requests: int = 0, connections: int = 0) -> None:
+        with cls.__lock:
+            cls.requests += requests
+            cls.connections += connections
+
+    class Adapter(HTTPAdapter):
+        def __init__(self, timeout: int, **kwargs: Any):
+            """
+            Pools connections, applies a default timeout and counts new
+            connections
+            Args:
+                timeout: Seconds to wait to connect and between received data
+                kwargs: Arguments passed to HTTPAdapter
+            """
+            self.__timeout = timeout
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": Http.HTTPConnectionPool,
+                "https": Http.HTTPSConnectionPool,
+            }
+
+        def send(self, request, **kwargs: Any) -> Response:
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = self.__timeout
+            Http.count(requests=1)
+            return super().send(request, **kwargs)
+
+    class HTTPConnectionPool(HTTPConnectionPool):
+        def _new_conn(self):
+            Http.count(connections=1)
+            return super()._new_conn()
+
+    class HTTPSConnectionPool(HTTPSConnectionPool):
+        def _new_conn(self):
+            Http.count(connections=1)
+            return super()._new_conn()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int = 1,
+        queue_size: int = 0,
+    ):
+        """
+        A single step of a pipeline
+        Args:
+            name: Name of the stage, used for thread names
+            func: Called with each item, returns the item passed to the next
+            stage or None to drop it
+            workers: Number of items processed at once
+            queue_size: Maximum number of items waiting for this stage, 0 for
+            no limit
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+
+
+class Pipeline:
+    """
+    Runs items through a series of stages joined by bounded queues.
+    Each stage has its own worker threads so slow stages overlap with each other.
+
+    with Pipeline([Stage("a", step_a), Stage("b", step_b, workers=4)]) as p:
+        for item in items:
+            p.put(item)
+    """
+
+    __DONE = object()
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        on_drop: Callable[[Any], None] | None = None,
+    ):
+        """
+        Args:
+            stages: Stages in the order items pass through them
+            on_drop: Called with items that don't reach the end of the pipeline
+        """
+        self.__stages = stages
+        self.__on_drop = on_drop
+        self.__queues: list[Queue] = [Queue(stage.queue_size) for stage in stages]
+        self.__remaining = [stage.workers for stage in stages]
+        self.__lock = Lock()
+        self.__error: BaseException | None = None
+        self.__stopped = False
+        self.__threads: list[Thread] = []
+
+    def start(self) -> Pipeline:
+        for i, stage in enumerate(self.__stages):
+            for n in range(stage.workers):
+                thread = Thread(
+                    target=self.__work,
+                    args=(i,),
+                    name=f"{stage.name}-{n}",
+                    daemon=True,
+                )
+                thread.start()
+                self.__threads.append(thread)
+        return self
+
+    def put(self, item: Any) -> None:
+        """
+        Adds an item to the first stage, blocks while its queue is full
+        Args:
+            item: Item to process
+        """
+        if self.__error is not None:
+            raise self.__error
+        self.__queues[0].put(item)
+
+    def join(self) -> None:
+        """
+        Waits until all items have passed through the pipeline. Raises the first
+        exception that escaped a stage.
+        """
+        self.__queues[0].put(Pipeline.__DONE)
+        for thread in self.__threads:
+            thread.join()
+        if self.__error is not None:
+            raise self.__error
+
+    def stop(self) -> None:
+        """
+        Drops every item that hasn't been processed yet and waits for the items
+        already being processed. Exceptions that escaped a stage are not raised.
+        """
+        self.__stopped = True
+        self.__queues[0].put(Pipeline.__DONE)
+        for thread in self.__threads:
+            thread.join()
+
+    def __work(self, index: int) -> None:
+        stage = self.__stages[index]
+        inbox = self.__queues[index]
+        last = index == len(self.__stages) - 1
+        while True:
+            item = inbox.get()
+            if item is Pipeline.__DONE:
+                # Leave it for the other workers of this stage
+                inbox.put(item)
+                break
+            # Stop doing work after a failure, but keep draining queues so
+            # producers don't block
+            if self.__stopped or self.__error is not None:
+                self.__drop(item)
+                continue
+            try:
+                result = stage.func(item)
+            except BaseException as e:
+                with self.__lock:
+                    if self.__error is None:
+                        self.__error = e
+                self.__drop(item)
+                continue
+            if result is None:
+                self.__drop(item)
+            elif not last:
+                self.__queues[index + 1].put(result)
+
+        # Last worker out closes the next stage
+        with self.__lock:
+            self.__remaining[index] -= 1
+            close = self.__remaining[index] == 0
+        if close and not last:
+            self.__queues[index + 1].put(Pipeline.__DONE)
+
+    def __drop(self, item: Any) -> None:
+        if self.__on_drop is not None:
+            try:
+                self.__on_drop(item)
+            except Exception:
+                pass
+
+    def __enter__(self) -> Pipeline:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        if exc_type is None:
+            self.join()
+        else:
+            self.stop()
@@ -1,27 +1,37 @@
 from math import floor
 from pathlib import Path
 from time import time, sleep
+from typing import BinaryIO
 
 from librespot.core import PlayableContentFeeder
 from librespot.metadata import AlbumId, ArtistId
 from librespot.proto import Metadata_pb2 as Metadata
 from librespot.structure import GeneralAudioStream
 from librespot.util import bytes_to_hex
-from requests import get
 from tqdm import tqdm
 
-from zotify.file import LocalFile
+from zotify.cache import ImageCache
+from zotify.file import LocalFile, TranscodeStream
+from zotify.network import Http
 from zotify.utils import (
     AudioFormat,
     ImageSize,
     MetadataEntry,
+    Quality,
+    RateLimitClass,
     bytes_to_base62,
     fix_filename,
+    supported_readinto,
 )
 
 IMG_URL = "https://i.s" + "cdn.co/image/"
 LYRICS_URL = "https://sp" + "client.wg.sp" + "otify.com/color-lyrics/v2/track/"
 
+# Librespot only handles reads that stay within its 128 KiB chunks, larger
+# reads can run past the end of short files
+MAX_READ_SIZE = 64 * 1024
+PROGRESS_INTERVAL_SECS = 0.1
+
 
 class Lyrics:
     def __init__(self, lyrics: dict, **kwargs):
@@ -123,12 +133,15 @@ class Playable:
         output: Path | str,
         p_bar: tqdm = tqdm(disable=True),
         real_time: bool = False,
+        chunk_size: int = MAX_READ_SIZE,
     ) -> LocalFile:
         """
         Writes audio stream to file
         Args:
             output: File path of saved audio stream
             p_bar: tqdm progress bar
+            real_time: Download at the same rate as the track being played
+            chunk_size: Size of reads from the audio stream in bytes
         Returns:
             LocalFile object
         """
@@ -136,51 +149,167 @@ class Playable:
             output = Path(output).expanduser()
 
         file = f"{output}_tmp.ogg"
-        time_start = time()
-        downloaded = 0
-
         with open(file, "wb") as f, p_bar as p_bar:
-            chunk = None
-            while chunk != b"":
-                chunk = self.input_stream.stream().read(1024)
-                p_bar.update(f.write(chunk))
-                if real_time:
-                    downloaded += len(chunk)
-                    delta_current = time() - time_start
-                    delta_required = (downloaded / self.input_stream.size) * (
-                        self.duration / 1000
-                    )
-                    if delta_required > delta_current:
-                        sleep(delta_required - delta_current)
+            self.__copy_stream(f, p_bar, real_time, chunk_size)
         return LocalFile(Path(file), AudioFormat.VORBIS)
 
-    def get_cover_art(self, size: ImageSize = ImageSize.LARGE) -> bytes:
+    def transcode_audio_stream(
+        self,
+        output: Path | str,
+        audio_format: AudioFormat,
+        download_quality: Quality | None = None,
+        bitrate: int = -1,
+        ffmpeg: str = "",
+        opt_args: list[str] = [],
+        p_bar: tqdm = tqdm(disable=True),
+        real_time: bool = False,
+        chunk_size: int = MAX_READ_SIZE,
+    ) -> LocalFile:
+        """
+        Pipes audio stream into ffmpeg so it is transcoded while downloading
+        Args:
+            output: File path of saved audio stream
+            audio_format: Audio format to transcode to
+            download_quality: Quality used to pick the bitrate if none is given
+            bitrate: Bitrate to transcode file to in kbps
+            ffmpeg: Location of FFmpeg binary
+            opt_args: Additional arguments to pass to ffmpeg
+            p_bar: tqdm progress bar
+            real_time: Download at the same rate as the track being played
+            chunk_size: Size of reads from the audio stream in bytes
+        Returns:
+            LocalFile object
+        """
+        if not isinstance(output, Path):
+            output = Path(output).expanduser()
+
+        stream = TranscodeStream(
+            Path(f"{output}_tmp.{audio_format.value.ext}"),
+            audio_format,
+            download_quality,
+            bitrate,
+            ffmpeg,
+            opt_args,
+        )
+        try:
+            with p_bar as p_bar:
+                self.__copy_stream(stream, p_bar, real_time, chunk_size)
+        except BaseException:
+            stream.kill()
+            raise
+        return stream.close()
+
+    def __copy_stream(
+        self,
+        f: BinaryIO | TranscodeStream,
+        p_bar: tqdm,
+        real_time: bool,
+        chunk_size: int = MAX_READ_SIZE,
+    ) -> None:
+        stream = self.input_stream.stream()
+        chunk_size = max(1024, min(chunk_size, MAX_READ_SIZE))
+        readinto = supported_readinto(stream)
+        if readinto is not None:
+            view = memoryview(bytearray(chunk_size))
+
+        time_start = time()
+        last_update = time_start
+        downloaded = 0
+        pending = 0
+        while True:
+            if readinto is not None:
+                size = readinto(view)
+                if not size:
+                    break
+                f.write(view[:size])
+            else:
+                chunk = stream.read(chunk_size)
+                size = len(chunk)
+                if not size:
+                    break
+                f.write(chunk)
+            downloaded += size
+            pending += size
+
+            now = time()
+            if now - last_update >= PROGRESS_INTERVAL_SECS:
+                p_bar.update(pending)
+                pending = 0
+                last_update = now
+            if real_time:
+                delta_required = (downloaded / self.input_stream.size) * (
+                    self.duration / 1000
+                )
+                if delta_required > now - time_start:
+                    sleep(delta_required - (now - time_start))
+        p_bar.update(pending)
+
+    def get_cover_art(
+        self, size: ImageSize = ImageSize.LARGE, cache: ImageCache | None = None
+    ) -> bytes:
         """
         Returns image data of cover art
         Args:
             size: Size of cover art
+            cache: Cache to get the image from, each size has its own file ID
         Returns:
             Image data of cover art
         """
-        return get(
-            IMG_URL + bytes_to_hex(self.cover_images[size.value].file_id)
-        ).content
+        file_id = bytes_to_hex(self.cover_images[size.value].file_id)
+
+        def fetch() -> bytes:
+            response = Http.get(IMG_URL + file_id)
+            response.raise_for_status()
+            return response.content
+
+        if cache is None:
+            return fetch()
+        return cache.get(file_id, fetch)
 
 
 class Track(PlayableContentFeeder.LoadedStream, Playable):
     __lyrics: Lyrics
 
-    def __init__(self, track: PlayableContentFeeder.LoadedStream, api):
-        super(Track, self).__init__(
-            track.track,
-            track.input_stream,
-            track.normalization_data,
-            track.metrics,
-        )
+    def __init__(self, track: Metadata.Track, api):
+        """
+        Track created from its metadata. The audio stream is attached by load
+        once the track is going to be downloaded, so the output can be checked
+        without requesting an audio key.
+        Args:
+            track: Track metadata
+            api: API client used for lyrics and genres
+        """
+        super(Track, self).__init__(track, None, None, None)
         self.__api = api
         self.cover_images = self.album.cover_group.image
         self.metadata = self.__default_metadata()
 
+    def load(self, track: PlayableContentFeeder.LoadedStream) -> None:
+        """
+        Attaches the audio stream of the track
+        Args:
+            track: Loaded track from the content feeder
+        """
+        self.input_stream = track.input_stream
+        self.normalization_data = track.normalization_data
+        self.metrics = track.metrics
+        self.metadata.extend(
+            [
+                MetadataEntry(
+                    "replaygain_track_gain", self.normalization_data.track_gain_db, ""
+                ),
+                MetadataEntry(
+                    "replaygain_track_peak", self.normalization_data.track_peak, ""
+                ),
+                MetadataEntry(
+                    "replaygain_album_gain", self.normalization_data.album_gain_db, ""
+                ),
+                MetadataEntry(
+                    "replaygain_album_peak", self.normalization_data.album_peak, ""
+                ),
+            ]
+        )
+
     def __getattr__(self, name):
         try:
             return super().__getattribute__(name)
@@ -215,18 +344,6 @@ class Track(PlayableContentFeeder.LoadedStream, Playable):
             MetadataEntry("title", self.name),
             MetadataEntry("track", self.name),
             MetadataEntry("year", date.year),
-            MetadataEntry(
-                "replaygain_track_gain", self.normalization_data.track_gain_db, ""
-            ),
-            MetadataEntry(
-                "replaygain_track_peak", self.normalization_data.track_peak, ""
-            ),
-            MetadataEntry(
-                "replaygain_album_gain", self.normalization_data.album_gain_db, ""
-            ),
-            MetadataEntry(
-                "replaygain_album_peak", self.normalization_data.album_peak, ""
-            ),
         ]
 
     def get_lyrics(self) -> Lyrics:
@@ -247,6 +364,7 @@ class Track(PlayableContentFeeder.LoadedStream, Playable):
                 self.__api.invoke_url(
                     LYRICS_URL + bytes_to_base62(self.track.gid) + lyrics_request,
                     raw_url=True,
+                    limit_class=RateLimitClass.LYRICS,
                 )["lyrics"]
             )
             return self.__lyrics
@@ -280,17 +398,29 @@ class Track(PlayableContentFeeder.LoadedStream, Playable):
 
 
 class Episode(PlayableContentFeeder.LoadedStream, Playable):
-    def __init__(self, episode: PlayableContentFeeder.LoadedStream, api):
-        super(Episode, self).__init__(
-            episode.episode,
-            episode.input_stream,
-            episode.normalization_data,
-            episode.metrics,
-        )
+    def __init__(self, episode: Metadata.Episode, api):
+        """
+        Episode created from its metadata. The audio stream is attached by load
+        once the episode is going to be downloaded.
+        Args:
+            episode: Episode metadata
+            api: API client
+        """
+        super(Episode, self).__init__(episode, None, None, None)
         self.__api = api
         self.cover_images = self.episode.cover_image.image
         self.metadata = self.__default_metadata()
 
+    def load(self, episode: PlayableContentFeeder.LoadedStream) -> None:
+        """
+        Attaches the audio stream of the episode
+        Args:
+            episode: Loaded episode from the content feeder
+        """
+        self.input_stream = episode.input_stream
+        self.normalization_data = episode.normalization_data
+        self.metrics = episode.metrics
+
     def __getattr__(self, name):
         try:
             return super().__getattribute__(name)
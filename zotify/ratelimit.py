@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+
+
+class TokenBucket:
+    def __init__(self, calls: float, interval: float):
+        """
+        Allows a number of calls per interval. After being idle the full number
+        of calls can be made at once, then permits are refilled evenly over the
+        interval. Waiting threads are served in the order they arrived and wake
+        up when the next permit is available instead of polling.
+        Args:
+            calls: Number of calls allowed per interval
+            interval: Length of the interval in seconds
+        """
+        self.__condition = Condition()
+        self.__waiters: deque[object] = deque()
+        self.__capacity = float(calls)
+        self.__rate = calls / interval
+        self.__tokens = float(calls)
+        self.__updated = monotonic()
+
+    @property
+    def tokens(self) -> float:
+        """Number of permits available now"""
+        with self.__condition:
+            self.__refill()
+            return self.__tokens
+
+    @property
+    def waiting(self) -> int:
+        """Number of threads waiting for a permit"""
+        with self.__condition:
+            return len(self.__waiters)
+
+    def set_rate(self, calls: float, interval: float) -> None:
+        """
+        Changes the allowed rate, permits already available are kept up to the
+        new number of calls
+        Args:
+            calls: Number of calls allowed per interval
+            interval: Length of the interval in seconds
+        """
+        with self.__condition:
+            self.__refill()
+            self.__capacity = float(calls)
+            self.__rate = calls / interval
+            self.__tokens = min(self.__tokens, self.__capacity)
+            # Waiters recalculate how long they need to wait
+            self.__condition.notify_all()
+
+    def acquire(self) -> float:
+        """
+        Takes a permit, waiting until one is available
+        Returns:
+            Seconds spent waiting
+        """
+        start = monotonic()
+        waiter = object()
+        with self.__condition:
+            self.__waiters.append(waiter)
+            try:
+                while True:
+                    timeout = None
+                    if self.__waiters[0] is waiter:
+                        self.__refill()
+                        if self.__tokens >= 1:
+                            self.__tokens -= 1
+                            return monotonic() - start
+                        # Includes any pause still to come
+                        timeout = (
+                            max(0.0, self.__updated - monotonic())
+                            + (1 - self.__tokens) / self.__rate
+                        )
+                    self.__condition.wait(timeout)
+            finally:
+                # Also runs if the wait is interrupted so later threads move up
+                self.__waiters.remove(waiter)
+                self.__condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out permits for a while. Available permits are dropped so
+        calls don't burst when the pause ends. Threads that don't need a permit
+        are not affected.
+        Args:
+            seconds: Length of the pause
+        """
+        with self.__condition:
+            self.__refill()
+            self.__tokens = 0.0
+            self.__updated = max(self.__updated, monotonic() + seconds)
+            self.__condition.notify_all()
+
+    def __refill(self) -> None:
+        # Nothing is refilled until a pause ends
+        now = monotonic()
+        if now > self.__updated:
+            self.__tokens = min(
+                self.__capacity, self.__tokens + (now - self.__updated) * self.__rate
+            )
+            self.__updated = now
+
+
+class AdaptiveLimit:
+    def __init__(
+        self,
+        calls: float,
+        floor: float,
+        ceiling: float,
+        interval: float,
+        increase: float = 1,
+        decrease: float = 0.5,
+    ):
+        """
+        Token bucket whose rate follows what the server allows. The rate rises
+        additively while calls succeed and is cut multiplicatively when the
+        server throttles a call.
+        Args:
+            calls: Starting number of calls per interval
+            floor: Lowest number of calls per interval
+            ceiling: Highest number of calls per interval
+            interval: Length of the interval in seconds
+            increase: Calls per interval added after a full interval of
+            successful calls
+            decrease: Fraction of the rate kept after a call is throttled
+        """
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.rate = float(min(max(calls, self.floor), self.ceiling))
+        self.waited = 0.0
+        self.__interval = interval
+        self.__increase = increase
+        self.__decrease = decrease
+        self.__bucket = TokenBucket(self.rate, interval)
+        self.__lock = Lock()
+
+    @property
+    def tokens(self) -> float:
+        """Number of permits available now"""
+        return self.__bucket.tokens
+
+    @property
+    def waiting(self) -> int:
+        """Number of threads waiting for a permit"""
+        return self.__bucket.waiting
+
+    def acquire(self) -> float:
+        """
+        Takes a permit, waiting until one is available
+        Returns:
+            Seconds spent waiting
+        """
+        waited = self.__bucket.acquire()
+        with self.__lock:
+            self.waited += waited
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out permits for a while
+        Args:
+            seconds: Length of the pause
+        """
+        self.__bucket.pause(seconds)
+
+    def set_rate(self, calls: float) -> None:
+        """
+        Args:
+            calls: Number of calls per interval, kept between floor and ceiling
+        """
+        with self.__lock:
+            self.__set_rate(calls)
+
+    def succeeded(self) -> None:
+        """Raises the rate after a successful call"""
+        with self.__lock:
+            if self.rate < self.ceiling:
+                self.__set_rate(self.rate + self.__increase / self.rate)
+
+    def throttled(self) -> None:
+        """Cuts the rate after the server throttled a call"""
+        with self.__lock:
+            self.__set_rate(self.rate * self.__decrease)
+
+    def __set_rate(self, calls: float) -> None:
+        self.rate = min(max(calls, self.floor), self.ceiling)
+        self.__bucket.set_rate(self.rate, self.__interval)
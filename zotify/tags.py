@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+from io import SEEK_CUR, SEEK_END
+from pathlib import Path
+from struct import unpack
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+# Reading tags with music_tag parses every tag, the artwork and the codec info
+# just to get one value. These readers only read the tag headers and the values
+# asked for, seeking over everything else. Anything unexpected returns None so
+# the caller can fall back to music_tag.
+
+DEFAULT_KEYS = ("spotid", "isrc")
+# Standard ID3 frames for keys, other keys are read from user-defined TXXX frames
+ID3_FRAMES = {"isrc": b"TSRC"}
+MAX_VALUE_SIZE = 1024
+
+
+class ProbeError(Exception): ...
+
+
+def probe_tags(path: Path, keys: Iterable[str] = DEFAULT_KEYS) -> dict[str, str] | None:
+    """
+    Reads text tags from an audio file without loading the whole file
+    Args:
+        path: Location of the audio file
+        keys: Names of the tags to read, case insensitive
+    Returns:
+        Dictionary of lowercase tag names to values for tags that were found,
+        None if the file's format isn't supported or can't be parsed
+    """
+    keys = {k.lower() for k in keys}
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(4)
+            f.seek(0)
+            if magic == b"OggS":
+                return _probe_ogg(f, keys)
+            elif magic == b"fLaC":
+                return _probe_flac(f, keys)
+            elif magic[:3] == b"ID3":
+                return _probe_id3(f, keys)
+            elif magic[:4] != b"RIFF" and f.read(8)[4:8] == b"ftyp":
+                f.seek(0)
+                return _probe_mp4(f, keys)
+    except (OSError, ProbeError, UnicodeDecodeError, ValueError):
+        pass
+    return None
+
+
+def _read(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ProbeError("Unexpected end of file")
+    return data
+
+
+def _parse_vorbis_comments(
+    read: Callable[[int], bytes], skip: Callable[[int], None], keys: set[str]
+) -> dict[str, str]:
+    # Vorbis comments are prefixed by their lengths so large values like
+    # artwork can be skipped without reading them
+    tags: dict[str, str] = {}
+    skip(unpack("<I", read(4))[0])  # Vendor string
+    count = unpack("<I", read(4))[0]
+    longest = max(len(k) for k in keys) + 1
+    for _ in range(count):
+        length = unpack("<I", read(4))[0]
+        if length <= MAX_VALUE_SIZE:
+            comment = read(length)
+            key, sep, value = comment.partition(b"=")
+            if sep and key.decode("ascii").lower() in keys:
+                tags.setdefault(key.decode("ascii").lower(), value.decode("utf-8"))
+        else:
+            # Too big to be one of the tags being read
+            prefix = read(min(length, longest))
+            key = prefix.partition(b"=")[0].decode("ascii", "replace").lower()
+            if key in keys:
+                raise ProbeError("Unexpectedly large tag")
+            skip(length - len(prefix))
+        if len(tags) == len(keys):
+            break
+    return tags
+
+
+def _probe_ogg(f: BinaryIO, keys: set[str]) -> dict[str, str]:
+    # The first page only holds the identification header, the comment header
+    # starts on the second page and may continue over many pages. Page bodies
+    # are read as one stream and page headers are skipped over.
+    remaining = 0
+
+    def next_page() -> None:
+        nonlocal remaining
+        header = _read(f, 27)
+        if header[:4] != b"OggS":
+            raise ProbeError("Invalid Ogg page")
+        remaining = sum(_read(f, header[26]))
+
+    def read(size: int) -> bytes:
+        nonlocal remaining
+        data = bytearray()
+        while len(data) < size:
+            if remaining == 0:
+                next_page()
+                continue
+            chunk = _read(f, min(size - len(data), remaining))
+            remaining -= len(chunk)
+            data += chunk
+        return bytes(data)
+
+    def skip(size: int) -> None:
+        nonlocal remaining
+        while size > 0:
+            if remaining == 0:
+                next_page()
+                continue
+            step = min(size, remaining)
+            f.seek(step, SEEK_CUR)
+            remaining -= step
+            size -= step
+
+    # Skip the identification header
+    next_page()
+    f.seek(remaining, SEEK_CUR)
+    remaining = 0
+    magic = read(7)
+    if magic != b"\x03vorbis" and magic + read(1) != b"OpusTags":
+        raise ProbeError("Unsupported Ogg codec")
+    return _parse_vorbis_comments(read, skip, keys)
+
+
+def _probe_flac(f: BinaryIO, keys: set[str]) -> dict[str, str]:
+    f.seek(4)
+    while True:
+        header = _read(f, 4)
+        last = header[0] & 0x80
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:4], "big")
+        if block_type == 4:
+            end = f.tell() + length
+
+            def skip(size: int) -> None:
+                if f.tell() + size > end:
+                    raise ProbeError("Comment exceeds block")
+                f.seek(size, SEEK_CUR)
+
+            return _parse_vorbis_comments(lambda n: _read(f, n), skip, keys)
+        if last:
+            return {}
+        f.seek(length, SEEK_CUR)
+
+
+def _decode_id3_text(data: bytes) -> list[str]:
+    encoding = data[0]
+    if encoding == 0:
+        text = data[1:].decode("latin-1")
+    elif encoding == 1:
+        text = data[1:].decode("utf-16")
+    elif encoding == 2:
+        text = data[1:].decode("utf-16-be")
+    elif encoding == 3:
+        text = data[1:].decode("utf-8")
+    else:
+        raise ProbeError("Unknown ID3 text encoding")
+    return [t.lstrip("\ufeff") for t in text.split("\x00")]
+
+
+def _probe_id3(f: BinaryIO, keys: set[str]) -> dict[str, str]:
+    header = _read(f, 10)
+    version = header[3]
+    flags = header[5]
+    # ID3v2.2, unsynchronisation and extended headers are rare, leave them
+    # to music_tag
+    if version not in (3, 4) or flags & 0xC0:
+        raise ProbeError("Unsupported ID3 tag")
+    size = _synchsafe(header[6:10])
+    frames = {ID3_FRAMES[k]: k for k in keys if k in ID3_FRAMES}
+    tags: dict[str, str] = {}
+    end = 10 + size
+    while f.tell() + 10 <= end and len(tags) < len(keys):
+        frame = _read(f, 10)
+        frame_id = frame[:4]
+        if frame_id == b"\x00\x00\x00\x00":
+            break  # Padding
+        if version == 4:
+            frame_size = _synchsafe(frame[4:8])
+        else:
+            frame_size = unpack(">I", frame[4:8])[0]
+        if frame_id != b"TXXX" and frame_id not in frames:
+            f.seek(frame_size, SEEK_CUR)
+            continue
+        if frame[9] != 0:
+            raise ProbeError("Compressed or encrypted frame")
+        if frame_size > MAX_VALUE_SIZE:
+            f.seek(frame_size, SEEK_CUR)
+            continue
+        text = _decode_id3_text(_read(f, frame_size))
+        if frame_id == b"TXXX":
+            key = text[0].lower()
+            if key in keys and len(text) > 1:
+                tags.setdefault(key, text[1])
+        else:
+            tags.setdefault(frames[frame_id], text[0])
+    return tags
+
+
+def _synchsafe(data: bytes) -> int:
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def _atoms(f: BinaryIO, end: int | None = None) -> Iterator[tuple[bytes, int, int]]:
+    # Yields the type, body size and body offset of each atom, the file
+    # position is moved past the atom after each one is handled
+    if end is None:
+        f.seek(0, SEEK_END)
+        end = f.tell()
+        f.seek(0)
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, atom_type = unpack(">I4s", _read(f, 8))
+        header = 8
+        if size == 1:
+            size = unpack(">Q", _read(f, 8))[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            raise ProbeError("Invalid atom size")
+        yield atom_type, size - header, start + header
+        f.seek(start + size)
+
+
+def _find_atom(
+    f: BinaryIO, path: list[bytes], end: int | None = None
+) -> tuple[int, int] | None:
+    for atom_type, size, offset in _atoms(f, end):
+        if atom_type == path[0]:
+            if len(path) == 1:
+                return size, offset
+            f.seek(offset)
+            if path[0] == b"meta":
+                f.seek(4, SEEK_CUR)  # Version and flags
+            return _find_atom(f, path[1:], offset + size)
+    return None
+
+
+def _probe_mp4(f: BinaryIO, keys: set[str]) -> dict[str, str]:
+    # moov is often after the audio data, atoms are seeked over rather than read
+    found = _find_atom(f, [b"moov", b"udta", b"meta", b"ilst"])
+    if found is None:
+        return {}
+    size, offset = found
+    f.seek(offset)
+    tags: dict[str, str] = {}
+    for atom_type, item_size, item_offset in _atoms(f, offset + size):
+        if atom_type != b"----" or item_size > MAX_VALUE_SIZE:
+            continue
+        name = None
+        value = None
+        f.seek(item_offset)
+        for sub_type, sub_size, sub_offset in _atoms(f, item_offset + item_size):
+            f.seek(sub_offset)
+            if sub_type == b"name":
+                name = _read(f, sub_size)[4:].decode("utf-8").lower()
+            elif sub_type == b"data" and value is None:
+                value = _read(f, sub_size)[8:].decode("utf-8")
+        if name in keys and value is not None:
+            tags.setdefault(name, value)
+        if len(tags) == len(keys):
+            break
+    return tags
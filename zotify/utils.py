@@ -2,7 +2,7 @@ from argparse import Action
 from enum import Enum, IntEnum
 from pathlib import Path
 from re import IGNORECASE, sub
-from typing import Any, NamedTuple
+from typing import Any, Callable, NamedTuple
 from dataclasses import dataclass, field
 
 from librespot.audio.decoders import AudioQuality
@@ -141,6 +141,13 @@ class RateLimitMode(Enum):
     REDUCED = "reduced"
 
 
+class RateLimitClass(Enum):
+    AUDIO_KEY = "audio key"
+    METADATA = "metadata"
+    LYRICS = "lyrics"
+    WEB_API = "web api"
+
+
 class OptionalOrFalse(Action):
     def __init__(
         self,
@@ -217,3 +224,23 @@ def bytes_to_base62(id: bytes) -> str:
         base62
     """
     return BASE62.encode(id, 22).decode()
+
+
+def supported_readinto(stream: Any) -> Callable[[memoryview], int] | None:
+    """
+    Finds a readinto method that reads the same data as the stream's read method.
+    Streams built on in-memory buffers often only override read, leaving an
+    inherited readinto that reads from the wrong place.
+    Args:
+        stream: Readable stream
+    Returns:
+        Bound readinto method, or None if read must be used instead
+    """
+    mro = type(stream).__mro__
+    read_owner = next((c for c in mro if "read" in vars(c)), None)
+    readinto_owner = next((c for c in mro if "readinto" in vars(c)), None)
+    if read_owner is None or readinto_owner is None:
+        return None
+    if mro.index(readinto_owner) > mro.index(read_owner):
+        return None
+    return stream.readinto